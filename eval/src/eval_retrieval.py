@@ -1,3 +1,4 @@
+import argparse
 from dataclasses import dataclass
 import json
 import os
@@ -10,6 +11,8 @@ import tqdm
 current_dir = os.path.dirname(os.path.abspath(__file__))
 other_folder_path = os.path.join(current_dir, "../..", "src")
 sys.path.append(other_folder_path)
+from embedding_cache import get_model_name, slugify
+from embeddings import get_embeddings
 from index import Index
 
 # None if you don't want to sample
@@ -17,10 +20,29 @@ type SampleSize = None | int
 type QAPairs = List[(str, str)]
 
 
-def main(sample_size: SampleSize):
+def main(
+    sample_size: SampleSize,
+    embeddings_provider: str = None,
+    embeddings_model: str = None,
+    batch_size: int = None,
+    engine: str = "matrix",
+):
     eval_qa_dir = os.path.join(os.path.dirname(__file__), "..", "qa_pairs")
-    index_dir = os.path.join(os.path.dirname(__file__), "../..", "index")
-    index = Index(max_index_age_days=5, index_path=index_dir)
+    embeddings_provider = embeddings_provider or os.getenv("EMBEDDINGS_PROVIDER")
+    embeddings = get_embeddings(embeddings_provider, embeddings_model, batch_size)
+    # indexes built by different embedding models can't be shared, so any model but
+    # the app's default gets its own index directory
+    if embeddings_provider in (None, "openai") and embeddings_model is None:
+        index_name = "index"
+    else:
+        index_name = f"index-{slugify(get_model_name(embeddings))}"
+    index_dir = os.path.join(os.path.dirname(__file__), "../..", index_name)
+    index = Index(
+        max_index_age_days=5,
+        index_path=index_dir,
+        embeddings=embeddings,
+        engine=engine,
+    )
 
     eval_scored_qa_dir = os.path.join(
         os.path.dirname(__file__), "..", "qa_pairs_scored"
@@ -33,27 +55,27 @@ def main(sample_size: SampleSize):
             with open(scored_eval_qa_file_path, "w") as scored_eval_file:
                 print(f"evaluate {eval_qa_file} with sample size {sample_size}")
                 archive_date = eval_qa_file.split("_")[0]
+                qa_pairs = [
+                    qa_data
+                    for qa_data in read_qa_data_from_file(eval_file, sample_size)
+                    if qa_data.get("question", "") and qa_data.get("context", "")
+                ]
+                create_index_if_not_exist(index, archive_date)
+                # embed and search every question in one go
+                all_search_results = index.search_many(
+                    archive_date, [qa_data["question"] for qa_data in qa_pairs]
+                )
                 search_ranks = []
-                num_lines = sum(1 for _ in eval_file)
-                eval_file.seek(0)  # Reset file pointer to the beginning of the file
-                for idx, qa_data in enumerate(
-                    tqdm.tqdm(
-                        read_qa_data_from_file(eval_file, sample_size),
-                        total=sample_size or num_lines,
-                    )
+                for qa_data, search_results in zip(
+                    tqdm.tqdm(qa_pairs), all_search_results
                 ):
-                    question = qa_data.get("question", "")
-                    context = qa_data.get("context", "")
-                    if question and context:
-                        create_index_if_not_exist(index, index_dir, archive_date)
-                        search_results = index.search_index(archive_date, question)
-                        try:
-                            search_rank = search_results.index(context)
-                        except ValueError:
-                            search_rank = index.k  # 1 + max records from index
-                        qa_data["search_rank"] = search_rank
-                        print(json.dumps(qa_data), file=scored_eval_file)
-                        search_ranks.append(search_rank)
+                    try:
+                        search_rank = search_results.index(qa_data["context"])
+                    except ValueError:
+                        search_rank = index.k  # 1 + max records from index
+                    qa_data["search_rank"] = search_rank
+                    print(json.dumps(qa_data), file=scored_eval_file)
+                    search_ranks.append(search_rank)
             unique_values, counts = np.unique(search_ranks, return_counts=True)
             total_counts = sum(counts)
             for value, count in sorted(zip(unique_values, counts)):
@@ -62,17 +84,18 @@ def main(sample_size: SampleSize):
                 )
 
 
-def create_index_if_not_exist(index, index_dir, archive_date):
-    index_file = os.path.join(index_dir, f"{archive_date}.faiss_index", "index.faiss")
-    if not os.path.exists(index_file):
-        print(f"Index for {archive_date} does not exist. Creating it..")
-        index.create_vector_store(archive_date)
+def create_index_if_not_exist(index, archive_date):
+    # a no-op unless the month isn't indexed yet or its cached content has changed
+    index.create_vector_store(archive_date)
 
 
 def read_qa_data_from_file(file, sample_size):
     res = []
     for eval_record in file:
-        qa_data = json.loads(eval_record)
+        try:
+            qa_data = json.loads(eval_record)
+        except json.JSONDecodeError:
+            continue  # a row cut short when qa pair generation crashed
         confidence_level = float(qa_data.get("confidence_level", 0))
         if confidence_level == 1.0:
             res.append(qa_data)
@@ -86,4 +109,26 @@ def read_qa_data_from_file(file, sample_size):
 
 
 if __name__ == "__main__":
-    main(sample_size=100)
+    parser = argparse.ArgumentParser(description="Evaluate the retriever's ranking")
+    parser.add_argument("--sample-size", type=int, default=100)
+    parser.add_argument(
+        "--embeddings-provider",
+        choices=["openai", "local"],
+        help="defaults to $EMBEDDINGS_PROVIDER, or openai",
+    )
+    parser.add_argument("--embeddings-model")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument(
+        "--engine",
+        choices=["faiss", "matrix"],
+        default="matrix",
+        help="the index search engine to evaluate",
+    )
+    args = parser.parse_args()
+    main(
+        sample_size=args.sample_size,
+        embeddings_provider=args.embeddings_provider,
+        embeddings_model=args.embeddings_model,
+        batch_size=args.batch_size,
+        engine=args.engine,
+    )
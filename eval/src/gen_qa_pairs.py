@@ -1,7 +1,10 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import os
-import pandas as pd
-from phoenix.evals import OpenAIModel, llm_generate
+import threading
+
+import openai
 
 import sys
 
@@ -9,6 +12,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 other_folder_path = os.path.join(current_dir, "../..", "src")
 sys.path.append(other_folder_path)
 
+from cache import NewsCache
+from index import index_text
+from rate_limiter import RateLimiter
 from utils import get_current_date_key
 
 generate_questions_template = """\
@@ -50,68 +56,274 @@ def output_parser(response: str, index: int):
         return {"__error__": str(e)}
 
 
-def gen_qa_pair_file(filename):
-    print(f"Generating qa pairs for: {filename}")
-    cache_context_df = pd.read_json(filename)
-    cache_context_df = cache_context_df.drop(
-        labels=["lead_paragraph", "pub_date"], axis=1
-    )
-    cache_context_df["text"] = cache_context_df.apply(
-        lambda row: f"{row.headline} {row.abstract}", axis=1
-    )
-    questions_df = llm_generate(
-        dataframe=cache_context_df,
-        template=generate_questions_template,
-        model=OpenAIModel(
-            model="gpt-3.5-turbo",
-        ),
-        output_parser=output_parser,
-        concurrency=5,
-    )
-    return questions_df
+class GenerationBudget:
+    """
+    GenerationBudget is shared by every month being generated, so running months
+    concurrently never goes over the model's quota: each call waits for its share of
+    requests and (estimated) tokens per minute, and no calls are made once max_requests
+    have been made.
+    """
+
+    def __init__(
+        self, requests_per_minute=500, tokens_per_minute=200_000, max_requests=None
+    ):
+        self.requests = RateLimiter(requests_per_minute, burst=10)
+        self.tokens = RateLimiter(tokens_per_minute, burst=tokens_per_minute // 10)
+        self.max_requests = max_requests
+        self.requests_made = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, prompt):
+        """Wait until prompt can be sent; False if the budget is spent."""
+        with self._lock:
+            if (
+                self.max_requests is not None
+                and self.requests_made >= self.max_requests
+            ):
+                return False
+            self.requests_made += 1
+        self.requests.acquire()
+        # ~4 characters per token, plus room for the answer
+        self.tokens.acquire(len(prompt) / 4 + 200)
+        return True
+
+
+class SeenTexts:
+    """
+    SeenTexts is shared by every month being generated, so a story filed under
+    several months only gets one qa pair. A text is claimed while its qa pair is being
+    generated, and only counts as seen once its row is written: if generation fails
+    (or the budget is spent) the claim is released and another month may try it.
+    """
+
+    def __init__(self, texts=()):
+        self.texts = set(texts)
+        self.claimed = set()
+        self._lock = threading.Lock()
+
+    def __contains__(self, text):
+        with self._lock:
+            return text in self.texts
+
+    def claim(self, text):
+        """False if text already has a qa pair, or is being generated elsewhere."""
+        with self._lock:
+            if text in self.texts or text in self.claimed:
+                return False
+            self.claimed.add(text)
+            return True
+
+    def release(self, text):
+        with self._lock:
+            self.claimed.discard(text)
+
+    def add(self, text):
+        with self._lock:
+            self.claimed.discard(text)
+            self.texts.add(text)
+
+
+def read_generated(output_file):
+    """The rows already written to output_file. A row cut short by a crash is
+    skipped, so its context gets generated again."""
+    rows = []
+    if not os.path.exists(output_file):
+        return rows
+    with open(output_file, "r") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return rows
+
+
+def is_legacy(rows):
+    """Whether rows were written all at once by the llm_generate version of this
+    script, whose rows don't say which story they came from. Such a file was only
+    written once the whole month was done."""
+    return bool(rows) and not any("web_url" in row or "text" in row for row in rows)
+
+
+def row_text(row):
+    # legacy rows only have the context the model echoed back
+    return row.get("text") or row.get("context")
+
+
+def pending_contexts(cache, key, output_file, seen_texts):
+    """The (item, text) of each story of the month `key` without a qa pair yet, in
+    output_file or (seen_texts) another month."""
+    rows = read_generated(output_file)
+    if is_legacy(rows):
+        return []
+    done = {row.get("web_url") or row.get("text") for row in rows}
+    # only read the fields we need, lead_paragraph and pub_date are never loaded
+    items = cache.read(key, fields=["archive_date", "headline", "abstract", "web_url"])
+    pending = []
+    for item in items:
+        text = index_text(item)
+        if (item.get("web_url") or text) in done or text in seen_texts:
+            continue
+        pending.append((item, text))
+    return pending
 
 
-def list_files_by_date_reverse(directory):
-    filenames = os.listdir(directory)
-    filenames.sort(reverse=True)
-    return filenames
+def ends_with_newline(file_path):
+    with open(file_path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
 
 
-def main(max_files_to_process: int):
+def gen_qa_pair_file(cache, key, output_file, model, budget, seen_texts, concurrency=5):
+    """
+    Generate a qa pair for each story of the month `key` that doesn't have one yet,
+    appending each row to output_file (JSON lines) as soon as it is generated, so a
+    crashed run picks up where it stopped. Stories whose text already has a qa pair
+    in another month (seen_texts) are skipped.
     """
-    Loop over the JSON files in the `cache` folder and for each news story generate
+    pending = pending_contexts(cache, key, output_file, seen_texts)
+    print(f"Generating {len(pending)} qa pairs for: {key}")
+    if not pending:
+        return 0
+
+    write_lock = threading.Lock()
+    generated = 0
+    with open(output_file, "a") as f, ThreadPoolExecutor(concurrency) as executor:
+        if not ends_with_newline(output_file):
+            # end a row cut short by a crash, so the next row starts on its own line
+            f.write("\n")
+        futures = {
+            executor.submit(claim_and_generate, model, budget, seen_texts, text): (
+                item,
+                text,
+            )
+            for item, text in pending
+        }
+        for future in as_completed(futures):
+            item, text = futures[future]
+            qa_pair = future.result()
+            if qa_pair is None:
+                continue
+            if "__error__" in qa_pair:
+                print(f"Skipping {item.get('web_url')}: {qa_pair['__error__']}")
+                continue
+            qa_pair.update(
+                archive_date=item.get("archive_date"),
+                web_url=item.get("web_url"),
+                text=text,
+            )
+            with write_lock:
+                f.write(json.dumps(qa_pair) + "\n")
+                f.flush()
+            seen_texts.add(text)
+            generated += 1
+    return generated
+
+
+def claim_and_generate(model, budget, seen_texts, text):
+    """generate_qa_pair, unless another month got to text first."""
+    if not seen_texts.claim(text):
+        return None
+    qa_pair = None
+    try:
+        qa_pair = generate_qa_pair(model, budget, text)
+    finally:
+        if qa_pair is None or "__error__" in qa_pair:
+            seen_texts.release(text)
+    return qa_pair
+
+
+def generate_qa_pair(model, budget, text):
+    prompt = generate_questions_template.format(text=text)
+    if not budget.acquire(prompt):
+        return None
+    try:
+        # answers that aren't JSON are turned into an "__error__" by output_parser
+        return output_parser(model(prompt), 0)
+    except openai.OpenAIError as e:
+        # the API failed even after the model's own retries; skip this context
+        return {"__error__": str(e)}
+
+
+def pending_months(cache, eval_qa_dir, seen_texts, max_months):
+    """The newest (past) months that still have stories without a qa pair, whether
+    they were never started or a previous run stopped part way through them."""
+    current_cache_key = get_current_date_key()
+    months = []
+    for key in reversed(cache.keys()):
+        if len(months) >= max_months:
+            break
+        output_file = os.path.join(eval_qa_dir, f"{key}_qa_pairs.json")
+        if key != current_cache_key and pending_contexts(
+            cache, key, output_file, seen_texts
+        ):
+            months.append(key)
+    return months
+
+
+def main(
+    max_files_to_process: int, max_concurrent_months: int = 3, max_requests: int = None
+):
+    """
+    Loop over the months cached in the `cache` folder and for each news story generate
     a JSON entry with a question that an LLM has extracted from the context.
 
     The context is the same as what is used by the index to perform a query, so querying
     the index using the question should find the appropriate context most of
     the time.. and we will look at the ranking of the context (using index search)
     to evalute the quality of the retriever.
-    """
-    cache_dir = os.path.join(os.path.dirname(__file__), "../..", "cache")
-    current_cache_file = f"{get_current_date_key()}.json"
-    cache_files = [
-        os.path.join(cache_dir, f)
-        for f in list_files_by_date_reverse(cache_dir)
-        if f.endswith(".json") and f != current_cache_file
-    ]
 
+    Months are generated concurrently under one GenerationBudget; each month's file is
+    resumed if a previous run didn't finish it.
+    """
+    cache = NewsCache()
+    cache.cache_path = os.path.join(os.path.dirname(__file__), "../..", "cache")
     eval_qa_dir = os.path.join(os.path.dirname(__file__), "..", "qa_pairs")
     os.makedirs(eval_qa_dir, exist_ok=True)
-    files_processed = 0
-    for cache_file in cache_files:
-        files_processed += 1
-        output_file = os.path.join(
-            eval_qa_dir,
-            f"{os.path.basename(cache_file).replace('.json', '')}_qa_pairs.json",
-        )
-        if os.path.exists(output_file):
-            continue
-        questions_df = gen_qa_pair_file(cache_file)
+    # a story filed under several months only needs one qa pair
+    seen_texts = SeenTexts()
+    for qa_file in os.listdir(eval_qa_dir):
+        if qa_file.endswith("_qa_pairs.json"):
+            for row in read_generated(os.path.join(eval_qa_dir, qa_file)):
+                if row_text(row):
+                    seen_texts.add(row_text(row))
 
-        questions_df.to_json(output_file, orient="records", lines=True)
-        if files_processed >= max_files_to_process:
-            break
+    cache_keys = pending_months(cache, eval_qa_dir, seen_texts, max_files_to_process)
+
+    from phoenix.evals import OpenAIModel
+
+    model = OpenAIModel(model="gpt-3.5-turbo")
+    budget = GenerationBudget(max_requests=max_requests)
+
+    with ThreadPoolExecutor(max_concurrent_months) as executor:
+        futures = [
+            executor.submit(
+                gen_qa_pair_file,
+                cache,
+                cache_key,
+                os.path.join(eval_qa_dir, f"{cache_key}_qa_pairs.json"),
+                model,
+                budget,
+                seen_texts,
+            )
+            for cache_key in cache_keys
+        ]
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
-    main(max_files_to_process=1)
+    parser = argparse.ArgumentParser(description="Generate qa pairs from cached months")
+    parser.add_argument("--max-files", type=int, default=1)
+    parser.add_argument("--max-concurrent-months", type=int, default=3)
+    parser.add_argument(
+        "--max-requests", type=int, help="stop after this many LLM calls"
+    )
+    args = parser.parse_args()
+    main(
+        max_files_to_process=args.max_files,
+        max_concurrent_months=args.max_concurrent_months,
+        max_requests=args.max_requests,
+    )
@@ -0,0 +1,140 @@
+import math
+import re
+
+import numpy as np
+
+from utils import atomic_write
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    BM25Index is a small inverted index for lexical (keyword) search over one month of
+    archive items, so exact names of people, places or bills can be found without an
+    embedding call.
+
+    Postings are kept in flat numpy arrays: the postings of term t are
+    postings_docs[offsets[t]:offsets[t + 1]] (document rows) and the matching slice of
+    postings_tfs (term frequencies). Terms are stored sorted, so the whole index is
+    saved as plain arrays in one .npz file.
+
+    Attributes:
+        doc_ids (np.ndarray): the archive item id of each document row.
+        texts (np.ndarray): the indexed text of each document row.
+        k1 (float), b (float): the usual BM25 parameters.
+    """
+
+    def __init__(
+        self, terms, offsets, postings_docs, postings_tfs, doc_lengths, doc_ids, texts
+    ):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.texts = texts
+        self.k1 = 1.5
+        self.b = 0.75
+        self.average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, doc_ids, texts, search_texts=None):
+        """Index documents. search_texts, if given, is what gets tokenized for each
+        document (e.g. including the lead paragraph), while texts is what a search
+        returns."""
+        postings = {}
+        doc_lengths = []
+        for row, text in enumerate(search_texts or texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_postings = postings.setdefault(token, {})
+                term_postings[row] = term_postings.get(row, 0) + 1
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings_docs = []
+        postings_tfs = []
+        for term_id, term in enumerate(terms):
+            term_postings = postings[term]
+            postings_docs.extend(term_postings.keys())
+            postings_tfs.extend(term_postings.values())
+            offsets[term_id + 1] = offsets[term_id] + len(term_postings)
+
+        return cls(
+            np.array(terms, dtype=np.str_),
+            offsets,
+            np.array(postings_docs, dtype=np.int32),
+            np.array(postings_tfs, dtype=np.uint16),
+            np.array(doc_lengths, dtype=np.int32),
+            np.array(doc_ids, dtype=np.str_),
+            np.array(texts, dtype=np.str_),
+        )
+
+    def search(self, query, k):
+        """Return up to k (row, score) pairs for the documents matching query, best first."""
+        document_count = len(self.doc_lengths)
+        if document_count == 0 or k <= 0:
+            return []
+        scores = np.zeros(document_count, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end].astype(np.float32)
+            idf = math.log(1 + (document_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            length_norm = (
+                1 - self.b + self.b * self.doc_lengths[rows] / self.average_length
+            )
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self.k1 * length_norm)
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return [(int(row), float(scores[row])) for row in matches]
+
+    def save(self, file_path):
+        with atomic_write(file_path, "wb") as f:
+            np.savez(
+                f,
+                terms=self.terms,
+                offsets=self.offsets,
+                postings_docs=self.postings_docs,
+                postings_tfs=self.postings_tfs,
+                doc_lengths=self.doc_lengths,
+                doc_ids=self.doc_ids,
+                texts=self.texts,
+            )
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as arrays:
+            return cls(
+                arrays["terms"],
+                arrays["offsets"],
+                arrays["postings_docs"],
+                arrays["postings_tfs"],
+                arrays["doc_lengths"],
+                arrays["doc_ids"],
+                arrays["texts"],
+            )
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several rankings (lists of keys, best first) into one, best first.
+    Each key scores the sum of 1 / (k + rank) over the rankings it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=lambda key: scores[key], reverse=True)
@@ -1,8 +1,18 @@
+from collections import OrderedDict
+from collections.abc import Iterator
 from datetime import datetime
-import json
+import itertools
+import logging
 import os
+import threading
+import time
 
-from utils import file_is_expired
+from cache_backends import ColumnarBackend, JsonBackend
+from locks import file_lock
+from manifest import Manifest, file_hash
+from utils import file_is_expired, is_expired_since
+
+logger = logging.getLogger(__name__)
 
 
 class NewsCache:
@@ -12,24 +22,36 @@ class NewsCache:
     The cache has a maximum age limit, after which cached items are considered expired
     and are not returned.
 
+    How the items are stored on disk is up to the backend; by default they are stored
+    column by column so readers can ask for just the fields they need. Caches written
+    in the original JSON format are migrated to the backend the first time they are read.
+
     Attributes:
         cache_path (str): The directory path where cache files are stored.
         max_cache_age_days (int): The maximum age of cache items in days before they
         are considered expired.
+        backend: reads and writes cache files (ColumnarBackend or JsonBackend).
+        memory (MemoryLRU): items already read in this process, so repeated reads of a
+        month skip the disk until its file changes.
+        manifest (Manifest): when each month was fetched, its ETag, item count and
+        content hash, so checking a month's freshness needs no file system calls.
     """
 
-    def __init__(self, max_cache_age_days=5):
+    def __init__(self, max_cache_age_days=5, backend=None, max_memory_items=50_000):
         self.cache_path = "cache"
         self.max_cache_age_days = max_cache_age_days
+        self.backend = backend or ColumnarBackend()
+        self.memory = MemoryLRU(max_memory_items)
         os.makedirs(self.cache_path, exist_ok=True)
 
-    def get_by_date(self, year, month):
+    def get_by_date(self, year, month, fields=None):
         """
         Retrieve cached items based on the provided year and month.
 
         Args:
             year (str): The year in "YYYY" format.
             month (str): The month in "MM" format.
+            fields (List[str]): only read these fields of each item (default: all).
 
         Returns:
             - None if the cache item is not found or is expired.
@@ -37,32 +59,210 @@ class NewsCache:
         """
 
         key = f"{year}-{month}"
-        return self.get(key, self.max_cache_age_days)
+        return self.get(key, self.max_cache_age_days, fields)
 
-    def put_by_date(self, year, month, value):
+    def put_by_date(self, year, month, value, validators=None):
         """add item to cache if not already present
         Args:
             key (str): "YYYY-MM" formatted date
             value (List[ArchiveItem]:): archive items matching the key
+            validators (dict): the "etag" and "last_modified" the API sent with value
         """
         key = f"{year}-{month}"
-        self.put(key, value)
+        self.put(key, value, validators)
 
-    def get(self, key, max_cache_age_days):
-        try:
-            file_path = f"{self.cache_path}/{key}.json"
-            if file_is_expired(file_path, key, max_cache_age_days):
+    @property
+    def manifest(self):
+        """What is cached, see Manifest (looked up on use, as cache_path may change)."""
+        return Manifest.for_root(self.cache_path)
+
+    def get(self, key, max_cache_age_days, fields=None):
+        entry = self.get_entry(key, max_cache_age_days)
+        if entry is None:
+            return None
+        if is_expired_since(key, entry["fetched_at"], max_cache_age_days):
+            return None
+
+        # a rewritten month has a new content hash, so stale entries are never returned
+        memory_key = (key, tuple(fields) if fields is not None else None)
+        signature = entry["content_hash"]
+        value = self.memory.get(memory_key, signature)
+        if value is MemoryLRU.MISSING:
+            try:
+                value = self.backend.read(self.get_path(key), fields)
+            except FileNotFoundError:
                 return None
-            else:
-                with open(file_path, "r") as f:
-                    return json.load(f)
+            self.memory.put(memory_key, signature, value)
+        return value
 
+    def get_entry(self, key, max_cache_age_days=None):
+        """key's manifest entry. Months cached before there was a manifest are added
+        to it (and JSON caches migrated) the first time they are asked for."""
+        entry = self.manifest.get(key)
+        if entry is not None:
+            return entry
+        file_path = self.get_path(key)
+        if not os.path.exists(file_path):
+            self.migrate(key, max_cache_age_days)
+        try:
+            file_stat = os.stat(file_path)
         except FileNotFoundError:
             return None
+        return self.manifest.update(
+            key,
+            fetched_at=file_stat.st_mtime,
+            content_hash=file_hash(file_path),
+        )
+
+    def read(self, key, fields=None):
+        """Read the items cached under key whether or not they have expired."""
+        file_path = self.get_path(key)
+        if not os.path.exists(file_path):
+            self.migrate(key)
+        return self.backend.read(file_path, fields)
+
+    def put(self, key, value, validators=None, fetched_at=None):
+        """Store value under key. An iterator is consumed as it is written.
+
+        validators (e.g. an ETag) are recorded in the manifest with the value, so a
+        refresh can ask the API whether it changed instead of downloading it again."""
+        counter = None
+        if isinstance(value, Iterator):
+            counter = itertools.count()
+            value = (item for item, _ in zip(value, counter))
+        file_path = self.get_path(key)
+        self.backend.write(file_path, value)
+        if not isinstance(self.backend, JsonBackend):
+            # a JSON file that was never migrated (it had expired) is superseded now
+            json_path = f"{self.cache_path}/{key}.{JsonBackend.extension}"
+            if os.path.exists(json_path):
+                os.remove(json_path)
+        validators = validators or {}
+        self.manifest.update(
+            key,
+            fetched_at=fetched_at or time.time(),
+            etag=validators.get("etag"),
+            last_modified=validators.get("last_modified"),
+            count=len(value) if isinstance(value, list) else counter and next(counter),
+            content_hash=file_hash(file_path),
+        )
+
+    def get_validators(self, key):
+        """The validators recorded with key's value, or None. A value whose file is
+        gone has none, as a 304 for it would leave nothing to read."""
+        entry = self.get_entry(key)
+        if entry is None or not (entry.get("etag") or entry.get("last_modified")):
+            return None
+        if not os.path.exists(self.get_path(key)):
+            return None
+        return {"etag": entry.get("etag"), "last_modified": entry.get("last_modified")}
+
+    def get_content_hash(self, key):
+        """The hash of what is cached under key, or None if nothing is."""
+        entry = self.get_entry(key)
+        return entry and entry["content_hash"]
 
-    def put(self, key, value):
-        with open(f"{self.cache_path}/{key}.json", "w") as f:
-            json.dump(value, f)
+    def touch(self, key):
+        """Mark key's value as fresh again, e.g. when the API says it hasn't changed."""
+        self.manifest.update(key, fetched_at=time.time())
+
+    def lock(self, key):
+        """A lock held while key is fetched, so processes sharing this cache (e.g. the
+        cache warmer and an interactive session) don't download the same month twice."""
+        return file_lock(f"{self.cache_path}/{key}.lock")
 
     def get_path(self, key):
-        return f"{self.cache_path}/{key}.json"
+        return f"{self.cache_path}/{key}.{self.backend.extension}"
+
+    def keys(self):
+        """The keys of every cached month, including ones not migrated yet."""
+        extensions = {f".{self.backend.extension}", f".{JsonBackend.extension}"}
+        return sorted(
+            {
+                name.rsplit(".", 1)[0]
+                for name in os.listdir(self.cache_path)
+                if os.path.splitext(name)[1] in extensions and name != "manifest.json"
+            }
+        )
+
+    def migrate(self, key, max_cache_age_days=None):
+        """Rewrite a JSON cache file for key in this cache's format. The month keeps
+        the JSON file's modification time as when it was fetched, both in the
+        manifest and on the new file, so migrating never makes it look fresher. Given
+        max_cache_age_days, expired files are left alone (they will be refetched)."""
+        if isinstance(self.backend, JsonBackend):
+            return
+        json_path = f"{self.cache_path}/{key}.{JsonBackend.extension}"
+        if not os.path.exists(json_path):
+            return
+        json_stat = os.stat(json_path)
+        if max_cache_age_days is not None and file_is_expired(
+            json_path, key, max_cache_age_days, json_stat
+        ):
+            return
+        logger.info(f"Migrating {json_path} to {self.get_path(key)}")
+        self.put(key, JsonBackend().read(json_path), fetched_at=json_stat.st_mtime)
+        # the manifest may be rebuilt from the file's mtime (see get_entry); put has
+        # removed the JSON file
+        os.utime(self.get_path(key), (json_stat.st_atime, json_stat.st_mtime))
+
+
+class MemoryLRU:
+    """
+    MemoryLRU keeps the most recently read cache entries in memory, bounded by the
+    total number of items they hold. Each entry remembers the signature (the content
+    hash) of the month it was read from and is dropped when the signature changes. Entries are shared with callers, so they must not be modified.
+
+    Attributes:
+        max_items (int): the most items (e.g. archive items) held at once.
+        hits (int): reads answered from memory.
+        misses (int): reads that had to go to disk.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._items = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != signature:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, signature, value):
+        size = len(value) if isinstance(value, list) else 1
+        if size > self.max_items:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (signature, value, size)
+            self._items += size
+            while self._items > self.max_items:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "items": self._items,
+            }
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._items -= size
@@ -0,0 +1,171 @@
+import json
+import mmap
+import struct
+from collections.abc import Iterator
+
+import msgpack
+
+from utils import atomic_write
+
+
+class JsonBackend:
+    """
+    Stores a cache entry as one plain JSON document. This is the original cache format,
+    kept so existing caches can still be read (and migrated).
+    """
+
+    extension = "json"
+
+    def read(self, file_path, fields=None):
+        with open(file_path, "r") as f:
+            value = json.load(f)
+        return project(value, fields)
+
+    def write(self, file_path, value):
+        """An iterator is written one item at a time as it is consumed, so a streamed
+        archive never has to be held in memory first."""
+        with atomic_write(file_path) as f:
+            if isinstance(value, Iterator):
+                write_json_array(f, value)
+            else:
+                json.dump(value, f)
+
+
+class ColumnarBackend:
+    """
+    Stores a list of archive items column by column in a compact msgpack file, so a
+    reader can memory-map the file and decode only the columns it asks for.
+
+    Layout: MAGIC, a 4 byte header length, a msgpack header, then one msgpack blob per
+    column. The header records the item count, the byte range of every column, and
+    the columns that hold a single value for every item (e.g. `archive_date`), which
+    are stored once in the header instead of once per item. Columns with few distinct
+    values are dictionary encoded. Values that are not a list of dicts are stored
+    whole in the header.
+    """
+
+    extension = "msgpack"
+    MAGIC = b"NWSC\x01"
+    HEADER_LENGTH = struct.Struct("<I")
+    # marks a key that is absent from an item, so it stays absent when read back
+    MISSING = msgpack.ExtType(0, b"")
+
+    def read(self, file_path, fields=None):
+        with open(file_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self.read_mapped(mapped, fields)
+
+    def read_mapped(self, mapped, fields=None):
+        if mapped[: len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Not a columnar cache file.")
+        header_start = len(self.MAGIC) + self.HEADER_LENGTH.size
+        (header_length,) = self.HEADER_LENGTH.unpack_from(mapped, len(self.MAGIC))
+        header = msgpack.unpackb(mapped[header_start : header_start + header_length])
+        if "value" in header:
+            return project(header["value"], fields)
+
+        data_start = header_start + header_length
+        count = header["count"]
+        names = header["names"]
+        if fields is not None:
+            names = [name for name in names if name in fields]
+
+        columns = {}
+        for name in names:
+            if name in header["constants"]:
+                columns[name] = [header["constants"][name]] * count
+                continue
+            offset, length = header["columns"][name]
+            start = data_start + offset
+            column = msgpack.unpackb(
+                mapped[start : start + length], ext_hook=self._ext_hook
+            )
+            if isinstance(column, dict):
+                values = column["values"]
+                column = [values[code] for code in column["codes"]]
+            columns[name] = column
+
+        return [
+            {
+                name: columns[name][row]
+                for name in names
+                if columns[name][row] is not self.MISSING
+            }
+            for row in range(count)
+        ]
+
+    def write(self, file_path, value):
+        """An iterator is read into a list first: the header says which columns are
+        constant or dictionary encoded and where each one starts, which takes every
+        item. Use JsonBackend to write items as they arrive."""
+        items = list(value) if isinstance(value, Iterator) else value
+        if isinstance(items, list) and all(isinstance(item, dict) for item in items):
+            header, blobs = self._encode_columns(items)
+        else:
+            header, blobs = {"value": items}, []
+
+        packed_header = msgpack.packb(header)
+        with atomic_write(file_path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(self.HEADER_LENGTH.pack(len(packed_header)))
+            f.write(packed_header)
+            for blob in blobs:
+                f.write(blob)
+
+    def _encode_columns(self, items):
+        names = list(dict.fromkeys(name for item in items for name in item))
+        header = {"count": len(items), "names": names, "constants": {}, "columns": {}}
+        blobs = []
+        offset = 0
+        for name in names:
+            column = [item.get(name, self.MISSING) for item in items]
+            distinct = distinct_values(column)
+            if distinct is not None and len(distinct) == 1:
+                value = column[0]
+                if value is not self.MISSING:
+                    header["constants"][name] = value
+                    continue
+            if distinct is not None and len(distinct) <= len(column) // 2:
+                codes = [distinct[(type(value), value)] for value in column]
+                column = {"values": [value for _, value in distinct], "codes": codes}
+            blob = msgpack.packb(column)
+            header["columns"][name] = [offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        return header, blobs
+
+    def _ext_hook(self, code, data):
+        if code == self.MISSING.code:
+            return self.MISSING
+        return msgpack.ExtType(code, data)
+
+
+def distinct_values(column):
+    """Map each distinct (type, value) in column to a code, in order of first
+    appearance. Returns None when the values can't be hashed (e.g. nested lists)."""
+    try:
+        distinct = dict.fromkeys((type(value), value) for value in column)
+    except TypeError:
+        return None
+    return {key: code for code, key in enumerate(distinct)}
+
+
+def project(value, fields):
+    """Keep only the given fields of each item; non-tabular values are returned as is."""
+    if fields is None or not isinstance(value, list):
+        return value
+    return [
+        {name: item[name] for name in fields if name in item}
+        if isinstance(item, dict)
+        else item
+        for item in value
+    ]
+
+
+def write_json_array(f, items):
+    f.write("[")
+    for position, item in enumerate(items):
+        if position:
+            f.write(", ")
+        json.dump(item, f)
+    f.write("]")
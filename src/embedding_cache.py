@@ -0,0 +1,174 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    CachedEmbeddings wraps an embedding model and remembers every vector it computes,
+    keyed by the model name and a hash of the text, so a text is only ever sent to the
+    embedding endpoint once -- across months, runs and processes sharing cache_path.
+
+    Each model gets its own directory holding:
+        - vectors.bin: the vectors, one fixed-size row each, read through a memory map
+        - keys.txt: the text hash of each row, one per line, in row order
+        - meta.json: the vector dimension and dtype
+
+    Rows are only ever appended (under a file lock), so other processes pick up new
+    vectors by reading the lines added to keys.txt since they last looked.
+
+    Attributes:
+        embeddings (Embeddings): the model that computes vectors on a cache miss.
+        model_name (str): part of the cache key, so models never share vectors.
+        dtype (str): "float32", or "float16" to halve the size of the cache.
+    """
+
+    def __init__(self, embeddings, cache_path, model_name=None, dtype="float32"):
+        self.embeddings = embeddings
+        self.model_name = model_name or get_model_name(embeddings)
+        self.dtype = np.dtype(dtype)
+        self.cache_dir = os.path.join(cache_path, slugify(self.model_name))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.rows = {}
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._dim = None
+        self._keys_offset = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key("document", text) for text in texts]
+        return self._embed(keys, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        # some models embed queries differently from documents, so they are kept apart
+        key = self.key("query", text)
+        return self._embed(
+            [key], [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries, sending only the uncached ones in one batch."""
+        keys = [self.key("query", text) for text in texts]
+        return self._embed(keys, texts, self.embeddings.embed_documents)
+
+    def key(self, kind, text):
+        return hashlib.sha256(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _embed(self, keys, texts, embed):
+        with self._lock:
+            self._refresh()
+            missing = {
+                key: text for key, text in zip(keys, texts) if key not in self.rows
+            }
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            # the model is called without the lock, so other threads (e.g. other
+            # months being indexed) aren't kept waiting; _append skips any vector
+            # another thread or process added meanwhile
+            logger.debug(f"Embedding {len(missing)} of {len(keys)} texts")
+            vectors = embed(list(missing.values()))
+            with self._lock:
+                self._append(list(missing.keys()), vectors)
+        with self._lock:
+            return [
+                self._vectors[self.rows[key]].astype(np.float32).tolist()
+                for key in keys
+            ]
+
+    def _append(self, keys, vectors):
+        with open(os.path.join(self.cache_dir, "cache.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have appended since we last looked
+            self._refresh()
+            new_rows = [row for row, key in enumerate(keys) if key not in self.rows]
+            if new_rows:
+                self._write_meta(len(vectors[0]))
+                new_vectors = np.asarray(vectors, dtype=self.dtype)[new_rows]
+                vectors_file = os.path.join(self.cache_dir, "vectors.bin")
+                # a writer that died between writing vectors.bin and keys.txt left
+                # rows without keys; they are dropped so rows and keys stay aligned
+                valid_size = len(self.rows) * self._row_size()
+                if os.path.exists(vectors_file):
+                    size = os.path.getsize(vectors_file)
+                    if size != valid_size:
+                        logger.warning(
+                            f"Dropping {size - valid_size} bytes of vectors without keys from {vectors_file}"
+                        )
+                        os.truncate(vectors_file, valid_size)
+                with open(vectors_file, "ab") as f:
+                    f.write(new_vectors.tobytes())
+                with open(os.path.join(self.cache_dir, "keys.txt"), "a") as f:
+                    f.write("".join(f"{keys[row]}\n" for row in new_rows))
+            self._refresh()
+
+    def _refresh(self):
+        """Pick up rows appended since the last refresh (by us or another process).
+        Only keys whose vector has been written are picked up; vectors without a key
+        (being written, or left by a writer that died) are ignored."""
+        keys_file = os.path.join(self.cache_dir, "keys.txt")
+        if not os.path.exists(keys_file):
+            return
+        if os.path.getsize(keys_file) == self._keys_offset:
+            return
+        self._read_meta()
+        vectors_file = os.path.join(self.cache_dir, "vectors.bin")
+        vector_rows = os.path.getsize(vectors_file) // self._row_size()
+        with open(keys_file, "r") as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith("\n") or len(self.rows) >= vector_rows:
+                    break  # still being written
+                self.rows[line.rstrip("\n")] = len(self.rows)
+                self._keys_offset += len(line)
+        if not self.rows:
+            return
+        self._vectors = np.memmap(
+            vectors_file,
+            dtype=self.dtype,
+            mode="r",
+            shape=(len(self.rows), self._dim),
+        )
+
+    def _row_size(self):
+        return self._dim * self.dtype.itemsize
+
+    def _read_meta(self):
+        if self._dim is None:
+            with open(os.path.join(self.cache_dir, "meta.json"), "r") as f:
+                meta = json.load(f)
+            self._dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+
+    def _write_meta(self, dim):
+        meta_file = os.path.join(self.cache_dir, "meta.json")
+        if not os.path.exists(meta_file):
+            with atomic_write(meta_file) as f:
+                json.dump({"dim": dim, "dtype": self.dtype.name}, f)
+        self._read_meta()
+
+
+def get_model_name(embeddings):
+    return (
+        getattr(embeddings, "model", None)
+        or getattr(embeddings, "model_name", None)
+        or type(embeddings).__name__
+    )
+
+
+def slugify(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
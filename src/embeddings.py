@@ -0,0 +1,92 @@
+import logging
+import os
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def get_embeddings(provider=None, model=None, batch_size=None):
+    """Create the embedding model used to index and search the archive.
+
+    Vectors from different models can't be mixed, so an index built with one provider
+    needs its own index_path when switching to another.
+
+    Args:
+        provider: "openai" (remote, the default) or "local" (a sentence-transformers
+            model running on this machine). Defaults to $EMBEDDINGS_PROVIDER.
+        model: the model name (default: the provider's default model).
+        batch_size: how many texts are embedded per request / inference batch.
+    """
+    provider = provider or os.getenv("EMBEDDINGS_PROVIDER", "openai")
+    if provider == "openai":
+        # langchain_openai pulls in the whole openai SDK, so it waits until it's needed
+        from langchain_openai import OpenAIEmbeddings
+
+        kwargs = {"model": model} if model else {}
+        return OpenAIEmbeddings(chunk_size=batch_size or 300, **kwargs)
+    if provider == "local":
+        return LocalEmbeddings(
+            model_name=model or DEFAULT_LOCAL_MODEL, batch_size=batch_size or 64
+        )
+    raise ValueError(f"Unknown embeddings provider: {provider}")
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    LocalEmbeddings runs a sentence-transformers model on this machine, so indexing and
+    evaluation work offline at a predictable throughput. Texts are encoded in batches
+    of batch_size, using num_threads CPU threads. Vectors are normalized, so FAISS's L2
+    distance ranks them the same as cosine similarity.
+
+    Attributes:
+        model_name (str): a sentence-transformers model name or local path.
+        batch_size (int): texts per inference batch.
+        num_threads (int): CPU threads used for inference (default: torch's default).
+        device (str): where the model runs, e.g. "cpu" or "cuda".
+    """
+
+    def __init__(
+        self,
+        model_name=DEFAULT_LOCAL_MODEL,
+        batch_size=64,
+        num_threads=None,
+        device="cpu",
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.device = device
+        self._model = None
+
+    def get_model(self):
+        # loading torch and the model takes seconds, so it waits for the first embedding
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            if self.num_threads:
+                import torch
+
+                torch.set_num_threads(self.num_threads)
+            logger.info(f"Loading local embeddings model {self.model_name}")
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.get_model().encode(
+                texts[start : start + self.batch_size],
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            vectors.extend(batch.tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
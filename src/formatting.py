@@ -0,0 +1,98 @@
+from functools import cache
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS = 2000
+TABLE_HEADER = "| # | date | headline | abstract | url |\n|---|---|---|---|---|"
+
+
+@cache
+def get_token_counter(model="gpt-4o-mini"):
+    """A function counting the tokens in a text the way model does. tiktoken needs to
+    download its encodings once, so offline (or without tiktoken) this falls back to
+    about four characters per token (or if the model's encoding can't be loaded)."""
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(model)
+        return lambda text: len(encoding.encode(text))
+    # a missing encoding is downloaded with requests, whose errors are OSErrors; a
+    # model tiktoken doesn't know is a KeyError, a corrupt download a ValueError
+    except (ImportError, KeyError, ValueError, OSError) as e:
+        logger.warning(
+            f"Estimating tokens from characters, no tokenizer for {model}: {e}"
+        )
+        return lambda text: math.ceil(len(text) / 4)
+
+
+def format_archive_response(
+    response, max_tokens=DEFAULT_MAX_TOKENS, abstract_chars=200, count_tokens=None
+):
+    """Render an ArchiveResponse for the model as a compact markdown table, one row per
+    article (headline, publication date, URL and a truncated abstract).
+
+    The items are ranked best first, so when the table would go over max_tokens the
+    rows at the end are dropped and a line says how many were left out. The table
+    costs the same however long the searched date range is.
+
+    Args:
+        response (ArchiveResponse): what NYTApi.get_archives returned.
+        max_tokens: the most tokens the table may take.
+        abstract_chars: abstracts are cut (at a word) to about this many characters.
+        count_tokens: counts the tokens in a text (default: get_token_counter()).
+    """
+    if response.get("status") != "Ok":
+        return f"Error: {response.get('message')}"
+    items = response.get("responses") or []
+    if not items:
+        return "No articles found."
+
+    count_tokens = count_tokens or get_token_counter()
+    header = f"Found {len(items)} articles, best matches first.\n{TABLE_HEADER}"
+    used = count_tokens(header)
+    # every line after the header costs its newline too
+    separator = count_tokens("\n")
+    # room for the "omitted" line, which is the same size for any count we'd print
+    reserved = separator + count_tokens(omitted_line(len(items)))
+    lines = [header]
+    for rank, item in enumerate(items, start=1):
+        row = format_row(rank, item, abstract_chars)
+        row_tokens = separator + count_tokens(row)
+        remaining = len(items) - rank
+        if used + row_tokens + (reserved if remaining else 0) > max_tokens:
+            break
+        lines.append(row)
+        used += row_tokens
+    omitted = len(items) - (len(lines) - 1)
+    if omitted:
+        lines.append(omitted_line(omitted))
+    return "\n".join(lines)
+
+
+def format_row(rank, item, abstract_chars):
+    date = (item.get("pub_date") or item.get("archive_date") or "")[:10]
+    cells = [
+        str(rank),
+        date,
+        item.get("headline") or "",
+        truncate(item.get("abstract") or "", abstract_chars),
+        item.get("web_url") or "",
+    ]
+    return "| " + " | ".join(escape_cell(cell) for cell in cells) + " |"
+
+
+def omitted_line(count):
+    return f"({count} more omitted)"
+
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return f"{cut}…"
+
+
+def escape_cell(text):
+    return " ".join(text.split()).replace("|", "\\|")
@@ -0,0 +1,101 @@
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """
+    HttpClient sends GET requests over one pooled requests.Session, so every call
+    (from any thread) reuses kept-alive, gzip-compressed connections. Each attempt
+    waits for the rate limiter, and rate limited (429) or failed (5xx, connection
+    error, timeout) attempts are retried with exponential backoff, honoring the
+    server's Retry-After when it sends one.
+
+    Attributes:
+        rate_limiter (RateLimiter): throttles every attempt, retries included.
+        timeout (tuple): (connect, read) timeouts in seconds.
+        max_retries (int): how many times a failed request is retried.
+        backoff_factor (float): the first retry waits this many seconds, doubling after.
+        max_backoff (float): the longest wait between two attempts, in seconds.
+    """
+
+    def __init__(
+        self,
+        rate_limiter=None,
+        timeout=(10, 60),
+        max_retries=4,
+        backoff_factor=1.0,
+        max_backoff=60.0,
+        pool_size=10,
+    ):
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, headers=None, stream=False) -> requests.Response:
+        """GET url, retrying as needed. Returns the last response, whatever its status;
+        raises the last connection error or timeout if no attempt got a response."""
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(
+                    url, headers=headers, timeout=self.timeout, stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.get_backoff(attempt)
+                logger.warning(f"Request failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == self.max_retries
+                ):
+                    return response
+                delay = self.get_backoff(attempt, response.headers.get("Retry-After"))
+                logger.warning(
+                    f"Request returned {response.status_code}, retrying in {delay:.1f}s"
+                )
+                response.close()
+            time.sleep(delay)
+
+    def get_backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number attempt + 1."""
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            # jitter keeps concurrent callers from retrying in lockstep
+            delay = self.backoff_factor * 2**attempt * random.uniform(0.5, 1.0)
+        return min(delay, self.max_backoff)
+
+    def close(self):
+        self.session.close()
+
+
+def parse_retry_after(value):
+    """Retry-After is either a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,68 +1,780 @@
-from langchain_community.document_loaders import JSONLoader
-from langchain_text_splitters import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from collections import OrderedDict
 import os
 import logging
+import shutil
+import threading
+import time
 
-from cache import NewsCache
-from utils import file_is_expired
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from cache import MemoryLRU, NewsCache
+from embedding_cache import CachedEmbeddings, get_model_name
+from embeddings import get_embeddings
+from locks import file_lock
+from manifest import Manifest
+from matrix_index import MatrixIndex, search_matrices
+from utils import atomic_write, file_is_expired
 
 logger = logging.getLogger(__name__)
 
 
 class Index:
-    def __init__(self, cache=NewsCache(), max_index_age_days=5, index_path=None):
+    def __init__(
+        self,
+        cache=None,
+        max_index_age_days=5,
+        index_path=None,
+        embeddings=None,
+        cache_embeddings=True,
+        unified=False,
+        pool=None,
+        hybrid=True,
+        lexical_fields=("headline", "abstract"),
+        engine="faiss",
+        matrix_dtype="float32",
+        max_loaded_months=24,
+    ):
+        """
+        Args:
+            cache (NewsCache): where the archive items to index are read from
+                (default: a NewsCache over the "cache" directory).
+            max_index_age_days: how old a month indexed before there was a manifest
+                may be and still be trusted; months in the manifest are reindexed
+                only when their cached content changes.
+            embeddings: the embedding model (default: embeddings.get_embeddings(),
+                OpenAI unless $EMBEDDINGS_PROVIDER says otherwise).
+            cache_embeddings: remember every vector in `{index_path}/embedding_cache`,
+                so a text is never embedded twice, whichever month or run asks for it.
+            unified: keep every month in a single vector store (`all.faiss_index`)
+                with the month stored in each document's metadata, instead of one
+                vector store per month.
+            pool (IndexPool): where loaded vector stores are kept between searches
+                (default: the process-wide index_pool).
+            hybrid: also build a BM25 (keyword) index for each month, and fuse its
+                results with the vector search results by reciprocal rank.
+            lexical_fields: the archive item fields the BM25 index is built from, e.g.
+                add "lead_paragraph" to match names that only appear there.
+            engine: "faiss" searches the FAISS vector stores; "matrix" also saves each
+                month's vectors as a memory-mapped numpy matrix (see MatrixIndex) and
+                searches those instead, with no docstore to unpickle.
+            matrix_dtype: "float32", or "int8" for matrices a quarter of the size.
+            max_loaded_months: how many months' BM25 and matrix indexes are kept in
+                memory between searches (the least recently used are dropped).
+        """
         self.max_index_age_days = max_index_age_days
         self.index_path = index_path or "index"
-        self.cache = cache
+        self.cache = cache or NewsCache()
+        self.embeddings = embeddings
+        self.cache_embeddings = cache_embeddings
+        self.unified = unified
+        self.pool = pool or index_pool
+        self.hybrid = hybrid
+        self.lexical_fields = list(lexical_fields)
+        if engine not in ("faiss", "matrix"):
+            raise ValueError(f"Unknown search engine: {engine}")
+        self.engine = engine
+        self.matrix_dtype = matrix_dtype
         self.k = 5
+        self._cached_embeddings = None
+        self._lexical_indexes = MemoryLRU(max_loaded_months)
+        self._matrix_indexes = MemoryLRU(max_loaded_months)
+        # months are indexed concurrently, but a unified store can only take one at a time
+        self._unified_lock = threading.Lock()
         os.makedirs(self.index_path, exist_ok=True)
 
+    def get_embeddings(self):
+        # created on first use so an Index can be built without OpenAI credentials
+        if self.embeddings is None:
+            self.embeddings = get_embeddings()
+        if not self.cache_embeddings:
+            return self.embeddings
+        if self._cached_embeddings is None:
+            self._cached_embeddings = CachedEmbeddings(
+                self.embeddings, os.path.join(self.index_path, "embedding_cache")
+            )
+        return self._cached_embeddings
+
+    def get_embeddings_name(self):
+        """The embedding model the vectors come from, recorded with each month so an
+        index is never searched with vectors from another model."""
+        self.get_embeddings()
+        return get_model_name(self.embeddings)
+
+    def check_embeddings(self, archive_date):
+        """Raise ValueError if archive_date was indexed by another embedding model.
+        Months indexed before the model was recorded are taken to match."""
+        entry = self.manifest.get(self.get_manifest_key(archive_date))
+        indexed_with = entry and entry.get("embeddings")
+        embeddings_name = self.get_embeddings_name()
+        if indexed_with not in (None, embeddings_name):
+            raise ValueError(
+                f"{archive_date} in {self.index_path} was indexed with {indexed_with}, "
+                f"not {embeddings_name}; use an index_path for each embedding model"
+            )
+
+    def get_index_dir(self, archive_date):
+        if self.unified:
+            return f"{self.index_path}/all.faiss_index"
+        return f"{self.index_path}/{archive_date}.faiss_index"
+
+    def get_vector_store_dir(self, archive_date):
+        """Where the current version of the FAISS vector store is. Each save goes to a
+        new version directory and then CURRENT is switched to it, so readers never
+        load a store that is still being written. Indexes saved before versioning
+        have their store right in the index directory."""
+        index_dir = self.get_index_dir(archive_date)
+        try:
+            with open(os.path.join(index_dir, "CURRENT"), "r") as f:
+                return os.path.join(index_dir, f.read().strip())
+        except FileNotFoundError:
+            return index_dir
+
+    def get_freshness_file(self, archive_date):
+        """The file whose age said when archive_date was last indexed, before the
+        manifest recorded it. A unified index kept a marker file per month."""
+        if self.unified:
+            return os.path.join(
+                self.get_index_dir(archive_date), f"{archive_date}.indexed"
+            )
+        return os.path.join(self.get_vector_store_dir(archive_date), "index.faiss")
+
+    def get_lexical_index_file(self, archive_date):
+        if self.unified:
+            return os.path.join(
+                self.get_index_dir(archive_date), f"{archive_date}.bm25.npz"
+            )
+        return os.path.join(self.get_index_dir(archive_date), "bm25.npz")
+
+    def get_matrix_prefix(self, archive_date, vector_store_dir=None):
+        """The month's MatrixIndex files are saved in the version directory of the
+        FAISS store they were read from (see get_vector_store_dir), so switching
+        CURRENT switches the matrix, its norms and its doc ids together. Matrices
+        saved before that sit right in the index directory."""
+        name = f"{archive_date}.vectors" if self.unified else "vectors"
+        prefix = os.path.join(
+            vector_store_dir or self.get_vector_store_dir(archive_date), name
+        )
+        if vector_store_dir is None and not os.path.exists(f"{prefix}.meta.npz"):
+            legacy_prefix = os.path.join(self.get_index_dir(archive_date), name)
+            if os.path.exists(f"{legacy_prefix}.meta.npz"):
+                return legacy_prefix
+        return prefix
+
     def create_vector_store(self, search_date):
-        vector_store_name = f"{self.index_path}/{search_date}.faiss_index"
-        index_file = os.path.join(vector_store_name, "index.faiss")
-        if os.path.exists(index_file) and not file_is_expired(
-            index_file, search_date, self.max_index_age_days
-        ):
-            logger.debug(f"Index already exists for {search_date} and not expired")
+        # the file lock keeps other processes (e.g. the cache warmer) from building the
+        # same index at the same time; whoever waits finds it fresh and returns
+        if self.unified:
+            with self._unified_lock, file_lock(self.get_lock_file(search_date)):
+                self._create_vector_store(search_date)
+        else:
+            with file_lock(self.get_lock_file(search_date)):
+                self._create_vector_store(search_date)
+
+    def get_lock_file(self, archive_date):
+        return f"{self.get_index_dir(archive_date)}.lock"
+
+    @property
+    def manifest(self):
+        """What is indexed, see Manifest (looked up on use, as index_path may change)."""
+        return Manifest.for_root(self.index_path, "index.manifest.json")
+
+    def get_manifest_key(self, archive_date):
+        return f"all/{archive_date}" if self.unified else archive_date
+
+    def get_index_parts(self):
+        """What a complete index of a month is made of with this configuration."""
+        parts = {"faiss"}
+        if self.hybrid:
+            parts.add("bm25")
+        if self.engine == "matrix":
+            parts.add("matrix")
+        return parts
+
+    def _create_vector_store(self, search_date):
+        # the index is in sync as long as the month's cached content hasn't changed
+        content_hash = self.cache.get_content_hash(search_date)
+        manifest_key = self.get_manifest_key(search_date)
+        entry = self.manifest.get(manifest_key) or self.adopt_legacy_index(
+            search_date, content_hash
+        )
+        embeddings_name = self.get_embeddings_name()
+        same_embeddings = entry is None or entry.get("embeddings") in (
+            None,
+            embeddings_name,
+        )
+        if not same_embeddings:
+            if self.unified:
+                # the other months in the store have the other model's vectors
+                self.check_embeddings(search_date)
+            logger.warning(
+                f"Reindexing {search_date}, it was indexed with {entry['embeddings']}"
+            )
+        in_sync = (
+            same_embeddings
+            and entry is not None
+            and entry.get("content_hash") == content_hash
+        )
+        parts = set(entry.get("parts", [])) if in_sync else set()
+        if self.get_index_parts() <= parts:
+            logger.debug(f"Index for {search_date} is in sync with the cache")
             return
         else:
             logger.debug(f"Indexing {search_date}")
 
-        # Load your document
-        cached_data = self.cache.get_path(search_date)
-        schema = '.[]  | "\(.headline) \(.abstract)"'
-        loader = JSONLoader(cached_data, jq_schema=schema)
-        documents = loader.load()
+        # Load your document, reading only the fields that get indexed
+        fields = ["headline", "abstract", "web_url"]
+        if self.hybrid:
+            fields += [field for field in self.lexical_fields if field not in fields]
+        cached_items = self.cache.read(search_date, fields=fields)
+        if self.hybrid and "bm25" not in parts:
+            self.create_lexical_index(search_date, cached_items)
+            parts.add("bm25")
+        if "faiss" in parts:
+            if self.engine == "matrix" and "matrix" not in parts:
+                # versions are never written to, so the matrix goes in a new one
+                current_dir = self.get_vector_store_dir(search_date)
+                vector_store = self.load_vector_store(search_date)
+                vector_store_dir = self.save_vector_store(
+                    search_date,
+                    vector_store,
+                    self.build_matrix_index(search_date, vector_store),
+                )
+                self.pool.put(vector_store_dir, vector_store)
+                self.pool.remove(current_dir)
+                parts.add("matrix")
+            self.manifest.update(manifest_key, parts=sorted(parts))
+            return
 
-        # Split the document into manageable chunks
-        text_splitter = CharacterTextSplitter(chunk_size=300, chunk_overlap=0)
-        docs = text_splitter.split_documents(documents)
+        documents = build_documents(search_date, cached_items)
+        if self.unified:
+            # the same article can show up in more than one month's archive
+            documents = {f"{search_date}/{key}": doc for key, doc in documents.items()}
 
-        # Initialize the OpenAI Embeddings
-        embeddings = OpenAIEmbeddings(chunk_size=300)
+        current_dir = self.get_vector_store_dir(search_date)
+        if same_embeddings and os.path.exists(os.path.join(current_dir, "index.faiss")):
+            # only embed what changed since the month was indexed; the update works on
+            # its own copy so searches never see a half updated store
+            vector_store = self.load_vector_store(search_date, pooled=False)
+            indexed_ids = [
+                doc_id
+                for doc_id in vector_store.index_to_docstore_id.values()
+                if not self.unified or doc_id.startswith(f"{search_date}/")
+            ]
+            update_vector_store(vector_store, documents, indexed_ids)
+        else:
+            # Create a FAISS vector store from the documents and embeddings
+            from langchain_community.vectorstores import FAISS
 
-        # Create a FAISS vector store from the documents and embeddings
-        vector_store = FAISS.from_documents(docs, embeddings)
+            vector_store = FAISS.from_documents(
+                list(documents.values()),
+                self.get_embeddings(),
+                ids=list(documents.keys()),
+            )
 
-        # Save the FAISS index to disk
-        vector_store.save_local(f"{self.index_path}/{search_date}.faiss_index")
+        # Save the FAISS index (and the matrix read out of it) to disk
+        matrix_index = None
+        if self.engine == "matrix":
+            matrix_index = self.build_matrix_index(search_date, vector_store)
+            parts.add("matrix")
+        vector_store_dir = self.save_vector_store(
+            search_date, vector_store, matrix_index
+        )
+        self.pool.put(vector_store_dir, vector_store)
+        self.pool.remove(current_dir)
+        parts.add("faiss")
+        self.manifest.update(
+            manifest_key,
+            content_hash=content_hash,
+            indexed_at=time.time(),
+            count=len(documents),
+            parts=sorted(parts),
+            embeddings=embeddings_name,
+        )
 
-    def search_index(self, archive_date, topic):
-        embeddings = OpenAIEmbeddings()
-        logger.debug(
-            f"Looking for index: {f"{self.index_path}/{archive_date}.faiss_index"}"
+    def adopt_legacy_index(self, archive_date, content_hash):
+        """Add a month indexed before there was a manifest to it. An index that
+        hasn't expired (by max_index_age_days) is taken to match the cache, as it was
+        before; otherwise None is returned and the month gets reindexed."""
+        index_file = self.get_freshness_file(archive_date)
+        if not os.path.exists(index_file) or file_is_expired(
+            index_file, archive_date, self.max_index_age_days
+        ):
+            return None
+        parts = ["faiss"]
+        if os.path.exists(self.get_lexical_index_file(archive_date)):
+            parts.append("bm25")
+        if os.path.exists(f"{self.get_matrix_prefix(archive_date)}.meta.npz"):
+            parts.append("matrix")
+        return self.manifest.update(
+            self.get_manifest_key(archive_date),
+            content_hash=content_hash,
+            indexed_at=os.stat(index_file).st_mtime,
+            parts=parts,
         )
-        get_vector_store = FAISS.load_local(
-            f"{self.index_path}/{archive_date}.faiss_index",
-            embeddings,
-            allow_dangerous_deserialization=True,
+
+    def save_vector_store(self, archive_date, vector_store, matrix_index=None):
+        """Save vector_store (and the month's matrix_index, if any) as a new version
+        and make it the current one. The version before it is kept for readers that
+        resolved it just before the switch."""
+        index_dir = self.get_index_dir(archive_date)
+        version = f"v{time.time_ns()}"
+        version_dir = os.path.join(index_dir, version)
+        vector_store.save_local(version_dir)
+        if self.unified:
+            # the other months' matrices carry over to the new version
+            self.link_matrix_files(
+                archive_date if matrix_index is not None else None,
+                self.get_vector_store_dir(archive_date),
+                version_dir,
+            )
+        if matrix_index is not None:
+            matrix_index.save(self.get_matrix_prefix(archive_date, version_dir))
+        with atomic_write(os.path.join(index_dir, "CURRENT")) as f:
+            f.write(version)
+        # matrices from before they were versioned are superseded by the new version
+        for name in os.listdir(index_dir):
+            if is_matrix_file(name):
+                os.remove(os.path.join(index_dir, name))
+        versions = sorted(
+            name
+            for name in os.listdir(index_dir)
+            if name.startswith("v") and name[1:].isdigit()
+        )
+        for old_version in versions[:-2]:
+            shutil.rmtree(os.path.join(index_dir, old_version), ignore_errors=True)
+        return os.path.join(index_dir, version)
+
+    def create_lexical_index(self, archive_date, archive_items):
+        doc_ids = []
+        seen = set()
+        texts = []
+        search_texts = []
+        for row, item in enumerate(archive_items):
+            doc_id = document_id(archive_date, row, item)
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            doc_ids.append(doc_id)
+            texts.append(index_text(item))
+            search_texts.append(
+                " ".join(item.get(field) or "" for field in self.lexical_fields)
+            )
+        lexical_index = BM25Index.build(doc_ids, texts, search_texts)
+        os.makedirs(self.get_index_dir(archive_date), exist_ok=True)
+        lexical_index.save(self.get_lexical_index_file(archive_date))
+
+    def load_lexical_index(self, archive_date):
+        """The month's BM25 index, or None for months indexed before there was one."""
+        index_file = self.get_lexical_index_file(archive_date)
+        try:
+            modified = os.stat(index_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        lexical_index = self._lexical_indexes.get(index_file, modified)
+        if lexical_index is MemoryLRU.MISSING:
+            lexical_index = BM25Index.load(index_file)
+            self._lexical_indexes.put(index_file, modified, lexical_index)
+        return lexical_index
+
+    def link_matrix_files(self, archive_date, from_dir, to_dir):
+        """Hard link the matrix files of every month but archive_date from from_dir
+        (or, for matrices saved before they were versioned, the index directory)
+        into to_dir. Matrix files are replaced, never written to, so sharing them
+        between versions is safe."""
+        index_dir = os.path.dirname(to_dir)
+        for directory in dict.fromkeys([index_dir, from_dir]):
+            for name in os.listdir(directory):
+                if not is_matrix_file(name) or (
+                    archive_date is not None and name.startswith(f"{archive_date}.")
+                ):
+                    continue
+                target = os.path.join(to_dir, name)
+                if os.path.exists(target):
+                    os.remove(target)
+                os.link(os.path.join(directory, name), target)
+
+    def build_matrix_index(self, archive_date, vector_store):
+        """The month's vectors from vector_store as a MatrixIndex. They are read back
+        out of the FAISS index, so nothing is embedded again."""
+        positions = []
+        documents = []
+        for position, doc_id in vector_store.index_to_docstore_id.items():
+            if self.unified and not doc_id.startswith(f"{archive_date}/"):
+                continue
+            positions.append(position)
+            documents.append(vector_store.docstore.search(doc_id))
+        vectors = vector_store.index.reconstruct_n(0, vector_store.index.ntotal)
+        return MatrixIndex.build(
+            vectors[positions].reshape(len(positions), vector_store.index.d),
+            [document.metadata.get("id", "") for document in documents],
+            [document.page_content for document in documents],
+            dtype=self.matrix_dtype,
         )
 
-        results = get_vector_store.similarity_search(topic, k=self.k)
+    def load_matrix_index(self, archive_date):
+        self.check_embeddings(archive_date)
+        prefix = self.get_matrix_prefix(archive_date)
+        modified = os.stat(f"{prefix}.meta.npz").st_mtime_ns
+        matrix_index = self._matrix_indexes.get(prefix, modified)
+        if matrix_index is MemoryLRU.MISSING:
+            matrix_index = MatrixIndex.load(prefix)
+            self._matrix_indexes.put(prefix, modified, matrix_index)
+        return matrix_index
+
+    def load_vector_store(self, archive_date, pooled=True):
+        self.check_embeddings(archive_date)
+        index_dir = self.get_vector_store_dir(archive_date)
+        if pooled:
+            return self.pool.get(index_dir, self.get_embeddings())
+        return load_faiss(index_dir, self.get_embeddings())
+
+    def embed_query(self, text):
+        """Embed a search query, so it can be reused across searches."""
+        return self.get_embeddings().embed_query(text)
+
+    def embed_queries(self, texts):
+        """Embed many search queries in as few requests as the model allows."""
+        embeddings = self.get_embeddings()
+        if hasattr(embeddings, "embed_queries"):
+            return embeddings.embed_queries(texts)
+        # the models we use embed a query the same way as a document
+        return embeddings.embed_documents(texts)
+
+    def search_index(self, archive_date, topic):
+        logger.debug(f"Looking for index: {self.get_index_dir(archive_date)}")
+        documents = self.search_documents([archive_date], topic, k=self.k)
+        results = [document.page_content for document in documents]
+
+        logger.debug(f"index matches: for {topic} in {archive_date}: {results}")
+        return results
+
+    def search_by_vector(self, archive_date, query_vector, k=None):
+        """Search one month with an already embedded query."""
+        return self.search_months_by_vector([archive_date], query_vector, k or self.k)
+
+    def search_many(self, archive_date, queries, k=None):
+        """Search one month for many queries at once, e.g. an evaluation's questions,
+        and return the text of each query's k best matches (default: self.k), like
+        search_index. The queries are embedded in batches and searched together."""
+        k = k or self.k
+        query_vectors = self.embed_queries(queries)
+        results = []
+        for query, vector_matches in zip(
+            queries, self.search_many_by_vector([archive_date], query_vectors, k)
+        ):
+            if self.hybrid:
+                lexical_matches = self.lexical_search([archive_date], query, k)
+                vector_matches = fuse_matches(vector_matches, lexical_matches, k)
+            results.append([document.page_content for document in vector_matches])
+        return results
+
+    def search_months(self, archive_dates, topic, k=None):
+        """Search several months for topic and return the text of the k best matches,
+        see search_documents."""
+        documents = self.search_documents(archive_dates, topic, k=k)
+        return [document.page_content for document in documents]
+
+    def search_documents(self, archive_dates, query, query_vector=None, k=None):
+        """Search several months for query and return the k best matching Documents,
+        best first. k defaults to self.k per month. Pass query_vector if the query has
+        already been embedded.
+
+        With hybrid search the vector matches and the BM25 matches are fused by
+        reciprocal rank, so exact names rank well even when their embedding doesn't.
+        """
+        k = k or self.k * len(archive_dates)
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+        vector_matches = self.search_documents_by_vector(archive_dates, query_vector, k)
+        if not self.hybrid:
+            return vector_matches
+        lexical_matches = self.lexical_search(archive_dates, query, k)
+        return fuse_matches(vector_matches, lexical_matches, k)
+
+    def lexical_search(self, archive_dates, query, k=None):
+        """Search several months' BM25 indexes for query, best first. This needs no
+        embedding call, so it is answered entirely in memory."""
+        k = k or self.k * len(archive_dates)
+        results = []
+        for archive_date in archive_dates:
+            lexical_index = self.load_lexical_index(archive_date)
+            if lexical_index is None:
+                continue
+            for row, score in lexical_index.search(query, k):
+                document = Document(
+                    page_content=str(lexical_index.texts[row]),
+                    metadata={
+                        "id": str(lexical_index.doc_ids[row]),
+                        "archive_date": archive_date,
+                    },
+                )
+                results.append((document, score))
+        results = sorted(results, key=lambda result: result[1], reverse=True)[:k]
+        return [document for document, _ in results]
+
+    def search_months_by_vector(self, archive_dates, query_vector, k=None):
+        """Search several months with an already embedded query and return the text of
+        the k best matches, see search_documents_by_vector."""
+        documents = self.search_documents_by_vector(archive_dates, query_vector, k)
+        return [document.page_content for document in documents]
+
+    def search_documents_by_vector(self, archive_dates, query_vector, k=None):
+        """Search several months with an already embedded query and return the k best
+        matching Documents across all of them, best first. k defaults to self.k per
+        month. Each Document's metadata holds the "id" of the archive item it indexes
+        (see document_id) and its "archive_date".
+
+        A unified index answers with a single search restricted to archive_dates; per
+        month indexes are each searched for their top k and the results merged.
+        """
+        k = k or self.k * len(archive_dates)
+        if self.engine == "matrix":
+            return self.matrix_search(archive_dates, [query_vector], k)[0]
+        if self.unified:
+            vector_store = self.load_vector_store(archive_dates[0])
+            months = set(archive_dates)
+            # a flat index scores every vector anyway, so fetching them all before
+            # filtering keeps the search exact
+            results = vector_store.similarity_search_with_score_by_vector(
+                query_vector,
+                k=k,
+                filter=lambda metadata: metadata.get("archive_date") in months,
+                fetch_k=vector_store.index.ntotal,
+            )
+        else:
+            results = [
+                result
+                for archive_date in archive_dates
+                for result in self.load_vector_store(
+                    archive_date
+                ).similarity_search_with_score_by_vector(query_vector, k=k)
+            ]
+            # scores are L2 distances, lower is better
+            results = sorted(results, key=lambda result: result[1])[:k]
 
         logger.debug(
-            f"index matches: for {topic} in {archive_date}: {[result.page_content for result in results]}"
+            f"index matches in {archive_dates}: {[doc.page_content for doc, _ in results]}"
         )
-        return [result.page_content for result in results]
+        return [doc for doc, _ in results]
+
+    def search_many_by_vector(self, archive_dates, query_vectors, k=None):
+        """Search several months with a batch of embedded queries and return the k
+        best matching Documents for each query, best first, like
+        search_documents_by_vector."""
+        k = k or self.k * len(archive_dates)
+        if self.engine == "matrix":
+            return self.matrix_search(archive_dates, query_vectors, k)
+        if self.unified:
+            # restricting a unified store to some months needs a filtered search
+            return [
+                self.search_documents_by_vector(archive_dates, query_vector, k)
+                for query_vector in query_vectors
+            ]
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        results = [[] for _ in query_vectors]
+        for archive_date in archive_dates:
+            vector_store = self.load_vector_store(archive_date)
+            month_k = min(k, vector_store.index.ntotal)
+            # one FAISS call searches every query
+            distances, positions = vector_store.index.search(query_vectors, month_k)
+            for query_results, query_distances, query_positions in zip(
+                results, distances, positions
+            ):
+                for distance, position in zip(query_distances, query_positions):
+                    if position == -1:
+                        continue
+                    doc_id = vector_store.index_to_docstore_id[position]
+                    query_results.append(
+                        (vector_store.docstore.search(doc_id), distance)
+                    )
+        return [
+            [doc for doc, _ in sorted(query_results, key=lambda result: result[1])[:k]]
+            for query_results in results
+        ]
+
+    def matrix_search(self, archive_dates, query_vectors, k=None):
+        """Search several months' MatrixIndexes with a batch of embedded queries at
+        once. Returns the k best matching Documents for each query, best first."""
+        k = k or self.k * len(archive_dates)
+        matrix_indexes = [
+            self.load_matrix_index(archive_date) for archive_date in archive_dates
+        ]
+        results = search_matrices(matrix_indexes, np.asarray(query_vectors), k)
+        return [
+            [
+                Document(
+                    page_content=str(matrix_indexes[position].texts[row]),
+                    metadata={
+                        "id": str(matrix_indexes[position].doc_ids[row]),
+                        "archive_date": archive_dates[position],
+                    },
+                )
+                for position, row in query_results
+            ]
+            for query_results in results
+        ]
+
+
+class IndexPool:
+    """
+    IndexPool keeps loaded FAISS vector stores in memory so repeated searches of a month
+    don't deserialize its index from disk each time. The least recently used stores are
+    evicted once their combined size on disk passes max_bytes. A store is reloaded when
+    its index file changes (e.g. another process rebuilt it).
+
+    Attributes:
+        max_bytes (int): the most bytes of index files held in memory at once.
+        hits (int): loads answered from memory.
+        misses (int): loads that had to read the index from disk.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._stores = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, index_dir, embeddings):
+        key = os.path.abspath(index_dir)
+        signature = index_signature(index_dir)
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None and entry[0] == signature:
+                self._stores.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        vector_store = load_faiss(index_dir, embeddings)
+        self.put(index_dir, vector_store, signature)
+        return vector_store
+
+    def put(self, index_dir, vector_store, signature=None):
+        """Keep vector_store, which was just loaded from or saved to index_dir."""
+        key = os.path.abspath(index_dir)
+        signature = signature or index_signature(index_dir)
+        size = sum(signature[1::2])
+        with self._lock:
+            if key in self._stores:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._stores[key] = (signature, vector_store, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._stores)))
+
+    def remove(self, index_dir):
+        """Forget the store loaded from index_dir, e.g. once it has been replaced."""
+        with self._lock:
+            key = os.path.abspath(index_dir)
+            if key in self._stores:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._stores.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, size = self._stores.pop(key)
+        self._bytes -= size
+
+
+# shared by every Index in the process, e.g. the agent and an evaluation run
+index_pool = IndexPool()
+
+
+def is_matrix_file(name):
+    """Whether name is one of the files a MatrixIndex is saved as."""
+    return name.endswith(("vectors.npy", "vectors.meta.npz"))
+
+
+def index_signature(index_dir):
+    """(mtime, size) of the files save_local writes; changes whenever they're rewritten."""
+    signature = []
+    for name in ["index.faiss", "index.pkl"]:
+        file_stat = os.stat(os.path.join(index_dir, name))
+        signature += [file_stat.st_mtime_ns, file_stat.st_size]
+    return tuple(signature)
+
+
+def load_faiss(index_dir, embeddings):
+    # langchain_community takes a while to import, so it waits for the first index
+    from langchain_community.vectorstores import FAISS
+
+    logger.debug(f"Loading index: {index_dir}")
+    return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+
+
+def index_text(item):
+    """The text indexed for an archive item: we concatenate heading and abstract to
+    capture the embedding from both."""
+    return f"{item.get('headline') or ''} {item.get('abstract') or ''}"
+
+
+def fuse_matches(vector_matches, lexical_matches, k):
+    """Fuse vector and BM25 matches by reciprocal rank and keep the k best. Documents
+    are matched up by month and archive item id (or text, for old indexes)."""
+    documents = {}
+    rankings = []
+    for matches in [vector_matches, lexical_matches]:
+        ranking = []
+        for document in matches:
+            key = (
+                document.metadata.get("archive_date"),
+                document.metadata.get("id") or document.page_content,
+            )
+            documents.setdefault(key, document)
+            ranking.append(key)
+        rankings.append(ranking)
+    return [documents[key] for key in reciprocal_rank_fusion(rankings)[:k]]
+
+
+def document_id(archive_date, row, item):
+    """A stable id for an archive item: its url, or its position in the month."""
+    return item.get("web_url") or f"{archive_date}#{row}"
+
+
+def build_documents(archive_date, archive_items):
+    """Map each archive item's id to the Document we index for it. Each item is
+    indexed as one document (headline and abstract are short enough to embed whole),
+    so the id also identifies the document in the vector store."""
+    documents = {}
+    for row, item in enumerate(archive_items):
+        doc_id = document_id(archive_date, row, item)
+        if doc_id not in documents:
+            documents[doc_id] = Document(
+                page_content=index_text(item),
+                metadata={"id": doc_id, "archive_date": archive_date},
+            )
+    return documents
+
+
+def update_vector_store(vector_store, documents, indexed_ids=None):
+    """Bring vector_store in line with documents: delete what is gone or changed, and
+    embed and add only what is new or changed. indexed_ids limits the update to part
+    of the store (default: all of it)."""
+    if indexed_ids is None:
+        indexed_ids = vector_store.index_to_docstore_id.values()
+    indexed_ids = set(indexed_ids)
+    stale_ids = {
+        doc_id
+        for doc_id in indexed_ids
+        if doc_id not in documents
+        or vector_store.docstore.search(doc_id).page_content
+        != documents[doc_id].page_content
+    }
+    if stale_ids:
+        vector_store.delete(list(stale_ids))
+    new_ids = [
+        doc_id
+        for doc_id in documents
+        if doc_id not in indexed_ids or doc_id in stale_ids
+    ]
+    if new_ids:
+        vector_store.add_documents([documents[i] for i in new_ids], ids=new_ids)
+    logger.info(f"Index update: {len(stale_ids)} removed, {len(new_ids)} added")
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.tools import StructuredTool
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "read_write", "record", "replay")
+
+
+class LLMCacheMiss(Exception):
+    """A replayed run asked the model (or a tool) something that was never recorded."""
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    SQLiteLLMCache keeps model responses in a SQLite database, so running the same
+    conversation again (e.g. an eval suite, or a regression run of the agent at
+    temperature 0) is answered from disk in milliseconds, even offline. Pass it to a
+    chat model as `cache=`.
+
+    Responses are keyed by a hash of the message list and of the model's settings,
+    which LangChain passes as llm_string: the model name, its parameters and the
+    tools bound to it. When there are more than max_entries responses, the least
+    recently used are removed.
+
+    Tool results go into the conversation, and so into the next model call's key. A
+    replay that ran the tools live would get different results (and miss) as soon as
+    the news changed, so tools wrapped with record_tool have their results recorded
+    and replayed in the same way, keyed by the tool's name and arguments.
+
+    Modes:
+        "read_write": answer from the cache when possible, record the rest.
+        "record": always call the model and record (or re-record) its responses.
+        "replay": only answer from the cache; a question that was never recorded
+            raises LLMCacheMiss instead of calling the model.
+        "off": neither read nor write.
+
+    Attributes:
+        database_path (str): the SQLite database file.
+        mode (str): one of MODES.
+        max_entries (int): the most responses (and, separately, tool results) kept.
+        hits (int): lookups answered from the cache by this object.
+        misses (int): lookups that went to the model.
+    """
+
+    def __init__(
+        self,
+        database_path="cache/llm_cache.sqlite",
+        mode="read_write",
+        max_entries=10_000,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.database_path = database_path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(database_path) or ".", exist_ok=True)
+        # one connection shared by the graph's threads; sqlite serializes processes
+        self._connection = sqlite3.connect(
+            database_path, timeout=30, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, llm_string TEXT, response TEXT, used_at REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results ("
+                "key TEXT PRIMARY KEY, name TEXT, result TEXT, used_at REAL)"
+            )
+
+    def lookup(self, prompt, llm_string):
+        response = self._lookup("responses", get_key(prompt, llm_string))
+        return None if response is None else load_generations(response)
+
+    def update(self, prompt, llm_string, return_val):
+        self._record(
+            "responses",
+            get_key(prompt, llm_string),
+            llm_string,
+            dump_generations(return_val),
+        )
+
+    def call_tool(self, name, args, call):
+        """call() for the tool `name` called with args, or its recorded result."""
+        key = get_tool_key(name, args)
+        result = self._lookup("tool_results", key)
+        if result is not None:
+            return json.loads(result)
+        result = call()
+        self._record("tool_results", key, name, json.dumps(result))
+        return result
+
+    async def acall_tool(self, name, args, call):
+        """call_tool for a call() returning an awaitable."""
+        key = get_tool_key(name, args)
+        result = self._lookup("tool_results", key)
+        if result is not None:
+            return json.loads(result)
+        result = await call()
+        self._record("tool_results", key, name, json.dumps(result))
+        return result
+
+    def clear(self, **kwargs):
+        """Forget every recorded response and tool result."""
+        with self._lock, self._connection:
+            for table in VALUE_COLUMNS:
+                self._connection.execute(f"DELETE FROM {table}")
+
+    def stats(self):
+        """hits and misses count model and tool lookups; entries is the number of
+        recorded responses and tool_results of tool results."""
+        with self._lock:
+            counts = {
+                table: self._connection.execute(
+                    f"SELECT COUNT(*) FROM {table}"
+                ).fetchone()[0]
+                for table in VALUE_COLUMNS
+            }
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": counts["responses"],
+            "tool_results": counts["tool_results"],
+        }
+
+    def close(self):
+        self._connection.close()
+
+    def _lookup(self, table, key):
+        if self.mode in ("off", "record"):
+            return None
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                f"SELECT {VALUE_COLUMNS[table]} FROM {table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    f"UPDATE {table} SET used_at = ? WHERE key = ?", (time.time(), key)
+                )
+                self.hits += 1
+            else:
+                self.misses += 1
+        if row is None and self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded {table} for {key}")
+        return row and row[0]
+
+    def _record(self, table, key, name, value):
+        if self.mode in ("off", "replay"):
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)",
+                (key, name, value, time.time()),
+            )
+            (entries,) = self._connection.execute(
+                f"SELECT COUNT(*) FROM {table}"
+            ).fetchone()
+            if entries > self.max_entries:
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE key IN "
+                    f"(SELECT key FROM {table} ORDER BY used_at LIMIT ?)",
+                    (entries - self.max_entries,),
+                )
+
+
+# the column holding what each table records
+VALUE_COLUMNS = {"responses": "response", "tool_results": "result"}
+
+
+def record_tool(tool, llm_cache):
+    """A copy of tool whose results are recorded and replayed by llm_cache. The tool
+    must return JSON serializable results."""
+    return StructuredTool.from_function(
+        func=lambda **args: llm_cache.call_tool(
+            tool.name, args, lambda: tool.func(**args)
+        ),
+        coroutine=(
+            lambda **args: llm_cache.acall_tool(
+                tool.name, args, lambda: tool.coroutine(**args)
+            )
+        )
+        if tool.coroutine
+        else None,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+    )
+
+
+def get_tool_key(name, args):
+    key = json.dumps({"name": name, "args": args}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+# message fields that don't change what the model is asked; LangGraph gives every
+# message a random id, so keeping them would make every run's key different
+IGNORED_MESSAGE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+
+def get_key(prompt, llm_string):
+    """Hash the model's settings (llm_string, including its bound tools) and the
+    message list (prompt, serialized by LangChain) into a cache key."""
+    digest = hashlib.sha256()
+    for part in (llm_string, canonical_prompt(prompt)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def canonical_prompt(prompt):
+    try:
+        messages = json.loads(prompt)
+    except json.JSONDecodeError:
+        return prompt
+    return json.dumps(strip_ignored_fields(messages), sort_keys=True)
+
+
+def strip_ignored_fields(value):
+    if isinstance(value, list):
+        return [strip_ignored_fields(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "lc" in value and isinstance(value.get("kwargs"), dict):
+        kwargs = {
+            name: strip_ignored_fields(field)
+            for name, field in value["kwargs"].items()
+            if name not in IGNORED_MESSAGE_FIELDS
+        }
+        return {**value, "kwargs": kwargs}
+    return {name: strip_ignored_fields(field) for name, field in value.items()}
+
+
+def dump_generations(generations):
+    return json.dumps(
+        [
+            {"message": message_to_dict(generation.message)}
+            if isinstance(generation, ChatGeneration)
+            else {"text": generation.text}
+            for generation in generations
+        ]
+    )
+
+
+def load_generations(response):
+    return [
+        ChatGeneration(message=messages_from_dict([generation["message"]])[0])
+        if "message" in generation
+        else Generation(text=generation["text"])
+        for generation in json.loads(response)
+    ]
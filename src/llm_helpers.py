@@ -1,4 +1,10 @@
-from langgraph.graph import MessagesState, StateGraph
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # langgraph takes a while to import, and is only needed for the annotations
+    from langgraph.graph import MessagesState, StateGraph
 
 def get_last_message(state: MessagesState):
         messages = state.get("messages", [])
@@ -17,6 +23,10 @@ def next_node_is_human(graph: StateGraph, config):
         return True
     return False
 
+async def anext_node_is_human(graph: StateGraph, config):
+    next_node = (await graph.aget_state(config)).next
+    return len(next_node) > 0 and next_node[0] == 'human_input'
+
 def last_message_has_tool_calls(state: MessagesState):
     last_message = get_last_message(state)
     args = last_message.additional_kwargs
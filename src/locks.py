@@ -0,0 +1,27 @@
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(lock_path, shared=False):
+    """Hold an advisory lock on lock_path (created if needed) for the duration of the
+    block. Processes sharing a cache or index directory take the same lock before
+    rebuilding a month, so one builds it while the others wait and then reuse it.
+    Every call opens the file anew, so threads of one process exclude each other too.
+    """
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.debug(f"Waiting for lock {lock_path}")
+            fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from locks import file_lock
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Manifest records what is stored under a cache or index directory, one entry per
+    month: e.g. when it was fetched, the API's ETag, how many items it has and a hash
+    of its content. Freshness and "is the index in sync with the cache" checks are
+    answered from memory instead of stat'ing files on every call.
+
+    The manifest is one JSON file (e.g. `manifest.json`) shared by every process using
+    the directory. Updates are made under a file lock and written atomically. Changes
+    made by other processes are picked up when the file's mtime changes, which is
+    checked at most every refresh_seconds. Use Manifest.for_root so every object in a
+    process shares one instance per manifest file.
+
+    Attributes:
+        root (str): the cache or index directory.
+        refresh_seconds (float): how stale the in-memory copy may get.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, root, name="manifest.json", refresh_seconds=1.0):
+        self.root = root
+        self.refresh_seconds = refresh_seconds
+        self.path = os.path.join(root, name)
+        self._entries = {}
+        self._mtime_ns = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_root(cls, root, name="manifest.json"):
+        key = os.path.abspath(os.path.join(root, name))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(root, name)
+            return cls._instances[key]
+
+    def get(self, key):
+        """The entry for key (not to be modified), or None."""
+        with self._lock:
+            self._refresh()
+            return self._entries.get(key)
+
+    def update(self, key, **fields):
+        """Merge fields into key's entry and return the new entry."""
+        with self._lock, file_lock(f"{self.path}.lock"):
+            # another process may have changed other entries since we last looked
+            self._refresh(force=True)
+            entry = {**self._entries.get(key, {}), **fields}
+            self._entries[key] = entry
+            self._write()
+            return entry
+
+    def remove(self, key):
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh(force=True)
+            if self._entries.pop(key, None) is not None:
+                self._write()
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < self.refresh_seconds
+        ):
+            return
+        self._checked_at = now
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._entries, self._mtime_ns = {}, None
+            return
+        if mtime_ns != self._mtime_ns:
+            with open(self.path, "r") as f:
+                self._entries = json.load(f)
+            self._mtime_ns = mtime_ns
+
+    def _write(self):
+        os.makedirs(self.root, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+
+def file_hash(file_path):
+    """sha256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,129 @@
+import numpy as np
+
+from utils import atomic_write
+
+
+class MatrixIndex:
+    """
+    MatrixIndex holds one month of document embeddings as a plain matrix saved with
+    numpy, so searching it needs no deserialization: the matrix is memory-mapped
+    (and its pages shared between processes), and a query is a matrix product.
+
+    Rows are ranked by L2 distance, like FAISS: for a query q the best rows have the
+    largest 2 q.x - |x|^2, so the squared norm of every row is stored alongside it.
+    With dtype "int8" each row is quantized with its own scale, which makes the matrix
+    four times smaller at a small cost in precision.
+
+    Files: `{prefix}.npy` (the matrix) and `{prefix}.meta.npz` (doc ids, texts, row
+    norms and, for int8, row scales).
+
+    Attributes:
+        vectors (np.ndarray): one row per document, float32 or int8.
+        norms (np.ndarray): the squared L2 norm of each (unquantized) row.
+        scales (np.ndarray): for int8 rows, the value of one quantization step.
+        doc_ids (np.ndarray): the archive item id of each row.
+        texts (np.ndarray): the indexed text of each row.
+    """
+
+    # int8 rows converted to float32 at once when scoring
+    block_rows = 4096
+
+    def __init__(self, vectors, norms, doc_ids, texts, scales=None):
+        self.vectors = vectors
+        self.norms = norms
+        self.doc_ids = doc_ids
+        self.texts = texts
+        self.scales = scales
+
+    @classmethod
+    def build(cls, vectors, doc_ids, texts, dtype="float32"):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = (vectors * vectors).sum(axis=1)
+        scales = None
+        if dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+        elif dtype != "float32":
+            raise ValueError(f"Unsupported matrix dtype: {dtype}")
+        return cls(
+            vectors,
+            norms,
+            np.array(doc_ids, dtype=np.str_),
+            np.array(texts, dtype=np.str_),
+            scales,
+        )
+
+    def scores(self, query_vectors):
+        """(queries x rows) scores, higher is closer."""
+        if self.vectors.dtype == np.float32:
+            products = query_vectors @ self.vectors.T
+        else:
+            # converting the whole int8 matrix to float32 would copy all of it (four
+            # times its size) on every search, so it is done a block of rows at a time
+            products = np.empty((len(query_vectors), len(self.vectors)), np.float32)
+            for start in range(0, len(self.vectors), self.block_rows):
+                block = self.vectors[start : start + self.block_rows]
+                products[:, start : start + len(block)] = (
+                    query_vectors @ block.T.astype(np.float32)
+                )
+            products *= self.scales
+        return 2 * products - self.norms
+
+    def save(self, prefix):
+        # other processes may have the old matrix mapped, so it is replaced rather
+        # than truncated and rewritten in place
+        with atomic_write(f"{prefix}.npy", "wb") as f:
+            np.save(f, self.vectors)
+        meta = {"norms": self.norms, "doc_ids": self.doc_ids, "texts": self.texts}
+        if self.scales is not None:
+            meta["scales"] = self.scales
+        with atomic_write(f"{prefix}.meta.npz", "wb") as f:
+            np.savez(f, **meta)
+
+    @classmethod
+    def load(cls, prefix):
+        vectors = np.load(f"{prefix}.npy", mmap_mode="r")
+        with np.load(f"{prefix}.meta.npz") as meta:
+            return cls(
+                vectors,
+                meta["norms"],
+                meta["doc_ids"],
+                meta["texts"],
+                meta["scales"] if "scales" in meta else None,
+            )
+
+
+def search_matrices(matrix_indexes, query_vectors, k):
+    """Search several MatrixIndexes with a batch of queries at once.
+
+    Every query is scored against every row of every index into one
+    (queries x total rows) matrix, and the best k of each query are picked with a
+    single argpartition. Returns, for each query, a list of (index position, row)
+    pairs, best first.
+    """
+    query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+    sizes = [len(matrix_index.doc_ids) for matrix_index in matrix_indexes]
+    total = sum(sizes)
+    if total == 0 or k <= 0:
+        return [[] for _ in query_vectors]
+
+    scores = np.empty((len(query_vectors), total), dtype=np.float32)
+    start = 0
+    for matrix_index, size in zip(matrix_indexes, sizes):
+        scores[:, start : start + size] = matrix_index.scores(query_vectors)
+        start += size
+
+    k = min(k, total)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    best = np.take_along_axis(best, np.argsort(-best_scores, axis=1), axis=1)
+
+    # map the global column back to (index position, row)
+    boundaries = np.cumsum(sizes)
+    positions = np.searchsorted(boundaries, best, side="right")
+    rows = best - (boundaries - np.array(sizes))[positions]
+    return [
+        list(zip(query_positions.tolist(), query_rows.tolist()))
+        for query_positions, query_rows in zip(positions, rows)
+    ]
@@ -1,31 +1,24 @@
+import argparse
+import asyncio
+from functools import cache, wraps
 import logging
 import os
-import sys
+import threading
 
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from langchain_core.tools import tool
-from langgraph.prebuilt import ToolNode
-from langgraph.graph import END, START, StateGraph, MessagesState
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.types import interrupt, Command
-from langsmith import utils
-from nyt_api import NYTApi, ArchiveResponse
-from opentelemetry.sdk.trace.export import ConsoleSpanExporter, SimpleSpanProcessor
-from openinference.instrumentation.langchain import LangChainInstrumentor
-from opentelemetry.sdk.trace.export import SimpleSpanProcessor
-
-from opentelemetry import trace
-from phoenix.otel import register
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import StructuredTool
+from formatting import format_archive_response
+from llm_cache import MODES as LLM_CACHE_MODES, SQLiteLLMCache, record_tool
+from web_cache import WebSearchCache
 from rich.console import Console
-from rich.markdown import Markdown
 from rich.text import Text
-from tavily import TavilyClient
 
 
 from llm_helpers import (
+    anext_node_is_human,
     get_last_content,
     get_last_message,
     last_message_has_tool_calls,
@@ -36,19 +29,73 @@ from prompt import get_system_message
 
 load_dotenv()
 logger = logging.getLogger(__name__)
-utils.tracing_is_enabled()
 
-nyt_news = NYTApi(os.getenv("NYT_API_KEY"), max_range=6)
-tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+# the longest date range, in months, one archive search may cover
+NYT_MAX_RANGE = 6
+# the most tokens an archive search result may add to the conversation
+NYT_RESULT_MAX_TOKENS = 2000
 
 console = Console()
 
-tracer_provider = register(
-    project_name="news-search",  # Default is 'default'
-    endpoint="http://localhost:4317",  # Sends traces using gRPC
-)
 
-LangChainInstrumentor().instrument(tracer_provider=tracer_provider)
+def create_once(create):
+    """Cache what create() returns, like functools.cache, but never call it twice:
+    parallel tool calls ask for the clients from several threads at once, and e.g.
+    two NYTApis would each have their own rate limiter for the same quota."""
+    create = cache(create)
+    lock = threading.Lock()
+
+    @wraps(create)
+    def get():
+        with lock:
+            return create()
+
+    get.cache_clear = create.cache_clear
+    return get
+
+
+# The clients below (and the OpenAI, Tavily and tracing SDKs they import) are created
+# the first time a question needs them, so starting the app stays quick.
+@create_once
+def get_nyt_api():
+    from nyt_api import NYTApi
+
+    return NYTApi(os.getenv("NYT_API_KEY"), max_range=NYT_MAX_RANGE)
+
+
+@create_once
+def get_tavily_client():
+    from tavily import TavilyClient
+
+    return TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+
+@create_once
+def get_async_tavily_client():
+    from tavily import AsyncTavilyClient
+
+    return AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+
+
+@create_once
+def get_web_search_cache():
+    return WebSearchCache()
+
+
+def tracing_is_enabled():
+    return os.getenv("NEWS_SEARCH_TRACING", "").lower() in ("1", "true", "yes")
+
+
+def setup_tracing():
+    """Send LangChain traces to a local Phoenix collector (see ARIZE.md)."""
+    from openinference.instrumentation.langchain import LangChainInstrumentor
+    from phoenix.otel import register
+
+    tracer_provider = register(
+        project_name="news-search",  # Default is 'default'
+        endpoint="http://localhost:4317",  # Sends traces using gRPC
+    )
+    LangChainInstrumentor().instrument(tracer_provider=tracer_provider)
 
 
 class ArchiveQuery(BaseModel):
@@ -70,21 +117,31 @@ def fancy_print(text: str, style=""):
     console.print(text)
 
 
-@tool("web_search")
-def web_search(query: str) -> dict:
+def search_web(query: str) -> str:
     """Call the Tavily API with query to search the web for a topic."""
     fancy_print(f'Searching for "{query}" on the web', "bright_cyan")
-    response = tavily_client.search(query)
-    return {"messages": [AIMessage(content=str(response))]}
+    # each Tavily search counts against a monthly quota, so repeats come from disk
+    response = get_web_search_cache().get_or_search(query, get_tavily_client().search)
+    return str(response)
 
 
-@tool(
-    "nyt_archive_search",
-    args_schema=ArchiveQuery,
-    return_direct=True,
-    parse_docstring=True,
+async def asearch_web(query: str) -> str:
+    """Call the Tavily API with query to search the web for a topic."""
+    fancy_print(f'Searching for "{query}" on the web', "bright_cyan")
+    web_search_cache = get_web_search_cache()
+    response = web_search_cache.get(query)
+    if response is None:
+        response = await get_async_tavily_client().search(query)
+        web_search_cache.put(query, response)
+    return str(response)
+
+
+web_search = StructuredTool.from_function(
+    func=search_web, coroutine=asearch_web, name="web_search"
 )
-def nyt_archive_search(topic: str, start_date: str, end_date: str) -> ArchiveResponse:
+
+
+def search_nyt_archive(topic: str, start_date: str, end_date: str) -> str:
     """Call the NYT Archive API with topic, start_date, end_date to search the NYT archive on a topic for a date range.
 
     Args:
@@ -95,24 +152,64 @@ def nyt_archive_search(topic: str, start_date: str, end_date: str) -> ArchiveRes
     fancy_print(
         f'Searching NYT for "{topic}" from {start_date} to {end_date}', "bright_cyan"
     )
-    response = nyt_news.get_archives(topic, start_date, end_date)
-    return {"messages": [AIMessage(content=str(response))]}
+    response = get_nyt_api().get_archives(topic, start_date, end_date)
+    # the result is sent back to the model on every later turn, so keep it compact
+    return format_archive_response(response, max_tokens=NYT_RESULT_MAX_TOKENS)
+
+
+async def asearch_nyt_archive(topic: str, start_date: str, end_date: str) -> str:
+    """search_nyt_archive for the async graph."""
+    # fetching and indexing is blocking work on NYTApi's own thread pool; running it
+    # in a thread lets other tool calls (and other date ranges) proceed meanwhile
+    return await asyncio.to_thread(search_nyt_archive, topic, start_date, end_date)
+
+
+nyt_archive_search = StructuredTool.from_function(
+    func=search_nyt_archive,
+    coroutine=asearch_nyt_archive,
+    name="nyt_archive_search",
+    args_schema=ArchiveQuery,
+    return_direct=True,
+    parse_docstring=True,
+)
 
 
 class NewsSearch:
-    def __init__(self):
+    def __init__(self, llm_cache=None):
+        """
+        Args:
+            llm_cache (SQLiteLLMCache): answer repeated model and tool calls from
+                disk, e.g. to replay recorded conversations (default: always call the
+                model and the tools).
+        """
+        from langchain_openai import ChatOpenAI
+        from langgraph.prebuilt import ToolNode
+
         tools = [nyt_archive_search, web_search]
+        if llm_cache is not None:
+            # a replayed conversation must see the tool results it was recorded with
+            tools = [record_tool(tool, llm_cache) for tool in tools]
         self.tool_node = ToolNode(tools)
-        self.model = ChatOpenAI(model="gpt-4o-mini", temperature=0).bind_tools(
-            tools, parallel_tool_calls=False
-        )
-
-    def call_model(self, state: MessagesState):
+        # the tools are safe to run side by side, so the model may ask for several
+        # (e.g. an archive and a web search) in one turn and they run concurrently
+        self.model = ChatOpenAI(
+            model="gpt-4o-mini", temperature=0, cache=llm_cache
+        ).bind_tools(tools, parallel_tool_calls=True)
+        self._graph = None
+
+    def call_model(self, state):
         messages = state["messages"]
         response = self.model.invoke(messages)
         return {"messages": [response]}
 
-    def should_continue(self, state: MessagesState):
+    async def acall_model(self, state):
+        messages = state["messages"]
+        response = await self.model.ainvoke(messages)
+        return {"messages": [response]}
+
+    def should_continue(self, state):
+        from langgraph.graph import END
+
         if last_message_has_tool_calls(state):
             return "tools"
         elif last_message_is_ask_for_human_input(state):
@@ -120,15 +217,24 @@ class NewsSearch:
         else:
             return END
 
-    def human_input(self, state: MessagesState):
+    def human_input(self, state):
+        from langgraph.types import interrupt
+
         human_message = interrupt("human_input")
         return {
             "messages": [HumanMessage(content=human_message)],
         }
 
     def build_graph(self):
+        # langgraph takes a while to import, so it is loaded once a graph is needed
+        # (and the nodes' state isn't annotated, as that would need it at import)
+        from langgraph.checkpoint.memory import MemorySaver
+        from langgraph.graph import START, MessagesState, StateGraph
+
         graph_builder = StateGraph(MessagesState)
-        graph_builder.add_node("agent", self.call_model)
+        graph_builder.add_node(
+            "agent", RunnableLambda(self.call_model, afunc=self.acall_model)
+        )
         graph_builder.add_node("tools", self.tool_node)
         graph_builder.add_node("human_input", self.human_input)
 
@@ -138,17 +244,30 @@ class NewsSearch:
         graph_builder.add_conditional_edges("agent", self.should_continue)
 
         checkpointer = MemorySaver()
-        graph = graph_builder.compile(checkpointer=checkpointer)
-        graph.get_graph(xray=1).draw_mermaid_png(output_file_path="graph.png")
-        return graph
+        return graph_builder.compile(checkpointer=checkpointer)
+
+    @property
+    def graph(self):
+        """The compiled graph, built on first use and reused for every question
+        (conversations are kept apart by the thread_id in their config)."""
+        if self._graph is None:
+            self._graph = self.build_graph()
+        return self._graph
+
+    def draw_graph(self, output_file_path="graph.png"):
+        """Render the graph as a PNG (through the mermaid.ink web service)."""
+        graph = self.graph.get_graph(xray=1)
+        graph.draw_mermaid_png(output_file_path=output_file_path)
 
     def run_graph(self, question, config):
+        from langgraph.types import Command
+
         fancy_print(f"Question: {question}", "deep_sky_blue3")
-        graph = self.build_graph()
+        graph = self.graph
         state = graph.invoke(
             {
                 "messages": [
-                    SystemMessage(content=get_system_message(nyt_news.max_range)),
+                    SystemMessage(content=get_system_message(NYT_MAX_RANGE)),
                     HumanMessage(content=question),
                 ]
             },
@@ -169,6 +288,39 @@ class NewsSearch:
             content = get_last_content(final_state)
         return content
 
+    async def arun_graph(self, question, config):
+        """Like run_graph, but the model and the tools are called asynchronously, so
+        the tool calls of a turn run concurrently."""
+        from langgraph.types import Command
+
+        fancy_print(f"Question: {question}", "deep_sky_blue3")
+        graph = self.graph
+        state = await graph.ainvoke(
+            {
+                "messages": [
+                    SystemMessage(content=get_system_message(NYT_MAX_RANGE)),
+                    HumanMessage(content=question),
+                ]
+            },
+            config=config,
+        )
+
+        content = get_last_content(state)
+        while await anext_node_is_human(graph, config):
+            console.print(
+                Text(f"{content}\nType '/quit' to exit =>", style="bold bright_cyan"),
+                end=" ",
+            )
+            improved_question = await asyncio.to_thread(console.input)
+            if improved_question.strip().lower() == "/quit":
+                console.print("Exiting...", style="bold red")
+                return "User exited the conversation."
+            final_state = await graph.ainvoke(
+                Command(resume=improved_question), config=config
+            )
+            content = get_last_content(final_state)
+        return content
+
 
 def main():
     os.makedirs("logs", exist_ok=True)
@@ -178,15 +330,44 @@ def main():
         format="%(asctime)s.%(levelname)s.%(name)s:%(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
-    if sys.argv[1:]:
-        topic = " ".join(sys.argv[1:])
+    parser = argparse.ArgumentParser(description="Search the news with an agent")
+    parser.add_argument("question", nargs="*", help="what you want to know about")
+    parser.add_argument(
+        "--draw-graph",
+        action="store_true",
+        help="save a diagram of the agent's graph to graph.png and exit",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=tracing_is_enabled(),
+        help="send traces to Phoenix (default: $NEWS_SEARCH_TRACING)",
+    )
+    parser.add_argument(
+        "--llm-cache",
+        choices=LLM_CACHE_MODES,
+        default=os.getenv("NEWS_SEARCH_LLM_CACHE", "off"),
+        help="reuse model responses from cache/llm_cache.sqlite; 'replay' never "
+        "calls the model (default: $NEWS_SEARCH_LLM_CACHE or off)",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        setup_tracing()
+    llm_cache = SQLiteLLMCache(mode=args.llm_cache) if args.llm_cache != "off" else None
+    news_search = NewsSearch(llm_cache=llm_cache)
+    if args.draw_graph:
+        news_search.draw_graph()
+        return
+    if args.question:
+        topic = " ".join(args.question)
     else:
         topic = "I want to know about the news from NYT archive about COVID from September 2024 through the end of the year"
     logger.info(f"{"*" * 80}")
     logger.info(f"News Search for: {topic}")
     config = {"configurable": {"thread_id": 1}, "recursion_limit": 12}
-    news_search = NewsSearch()
-    response = news_search.run_graph(question=topic, config=config)
+    response = asyncio.run(news_search.arun_graph(question=topic, config=config))
+    from rich.markdown import Markdown
+
     md = Markdown(response)
     console.print(md)
 
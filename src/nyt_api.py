@@ -1,8 +1,13 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
 from cache import NewsCache
-from index import Index
-from typing import Literal, TypedDict, List
+from http_client import HttpClient
+from index import Index, document_id, index_text
+from rate_limiter import RateLimiter
+from typing import Iterator, Literal, TypedDict, List
+import ijson
 import requests
+import urllib3
 import os
 import logging
 from datetime import datetime
@@ -30,18 +35,41 @@ class ArchiveResponse(TypedDict):
     responses: List[ArchiveItem]
 
 
+class ArchiveApiError(Exception):
+    """The NYT Archive API did not return a month, even after retrying."""
+
+
 class NYTApi:
+    # how many times a month whose download broke off part way is downloaded again
+    body_retries = 2
+
     def __init__(
         self,
         api_key: str,
         max_range: int = 12,
         cache: NewsCache = None,
         index: Index = None,
+        max_workers: int = 4,
+        requests_per_minute: float = 5,
+        http_client: HttpClient = None,
     ):
+        """
+        Args:
+            max_workers: how many months are fetched and indexed concurrently.
+            requests_per_minute: the NYT Archive API quota; calls that miss the cache are
+                throttled to stay under it, allowing a burst of up to that many calls.
+            http_client: sends the API requests (default: a pooled HttpClient that
+                retries and backs off, throttled by requests_per_minute).
+        """
         self.api_key = api_key
         self.cache = cache or NewsCache(max_cache_age_days=1)
-        self.index = index or Index(max_index_age_days=1)
+        self.index = index or Index(cache=self.cache, max_index_age_days=1)
         self.max_range = max_range
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(
+            requests_per_minute, burst=int(requests_per_minute)
+        )
+        self.http_client = http_client or HttpClient(rate_limiter=self.rate_limiter)
 
     def get_archives(
         self, topic: str, start_date: str, end_date: str
@@ -63,41 +91,91 @@ class NYTApi:
                     "responses": [],
                     "message": f"Your time range is too large. Choose a time range no longer than {self.max_range} {month}.",
                 }
-            archive_items_by_month = []
-            for year, month in months_to_query:
-                api_response = self.get_monthly_archive(year, month)
-                self.index.create_vector_store(f"{year}-{month}")
-                archive_items_by_month.append(api_response)
+            # embed the topic once for all the months, while they are being fetched
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                if topic is not None:
+                    topic_vector = executor.submit(self.index.embed_query, topic)
+                archive_items_by_month = self.get_and_index_months(months_to_query)
 
-            filtered_archive_items = self.filter_by_topic(archive_items_by_month, topic)
+            filtered_archive_items = self.filter_by_topic(
+                archive_items_by_month,
+                topic,
+                topic_vector.result() if topic is not None else None,
+            )
             return {"status": "Ok", "responses": filtered_archive_items}
 
-        except ValueError as ve:
-            return {"status": "Error", "message": ve.args[0], "responses": []}
+        except (ValueError, ArchiveApiError) as e:
+            return {"status": "Error", "message": e.args[0], "responses": []}
+
+    def get_and_index_months(self, months_to_query) -> List[List[ArchiveItem]]:
+        """Fetch and index each month on a bounded thread pool, so a multi-month query
+        waits roughly as long as its slowest month. Results keep the order of the months.
+        """
+        workers = max(1, min(self.max_workers, len(months_to_query)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="nyt-archive"
+        ) as executor:
+            return list(
+                executor.map(
+                    lambda year_month: self.get_and_index_month(*year_month),
+                    months_to_query,
+                )
+            )
+
+    def get_and_index_month(self, year, month) -> List[ArchiveItem]:
+        archive = self.get_monthly_archive(year, month)
+        self.index.create_vector_store(f"{year}-{month}")
+        return archive
 
     def filter_by_topic(
-        self, archive_items_by_month: List[List[ArchiveItem]], topic: str
+        self,
+        archive_items_by_month: List[List[ArchiveItem]],
+        topic: str,
+        topic_vector: List[float] = None,
     ) -> List[ArchiveItem]:
-        """This function filters the archive items by a given topic."""
+        """This function filters the archive items by a given topic, returning the
+        matches best first. Pass topic_vector if the topic has already been embedded."""
         if topic is None:
             return [
                 archive_item
                 for archive_items in archive_items_by_month
                 for archive_item in archive_items
             ]
-        response = []
+        # they all have the same 'archive_date' so pick the first one
+        archive_dates = [
+            archive_items[0].get("archive_date")
+            for archive_items in archive_items_by_month
+            if archive_items
+        ]
+        if not archive_dates:
+            return []
+        if topic_vector is None:
+            topic_vector = self.index.embed_query(topic)
+        matched_documents = self.index.search_documents(
+            archive_dates, topic, topic_vector
+        )
+
+        # map the matches back to archive items by id; indexes built before documents
+        # carried an id are matched on their exact text instead
+        items_by_id = {}
+        items_by_text = {}
         for archive_items in archive_items_by_month:
-            # they all have the same 'archive_date' so pick the first one
-            archive_date = archive_items[0].get("archive_date")
-            matched_items = self.index.search_index(archive_date, topic)
-
-            for archive_item in archive_items:
-                headline = archive_item.get("headline")
-                match_found = any(
-                    [headline in matched_item for matched_item in matched_items]
-                )
-                if match_found:
-                    response.append(archive_item)
+            for row, archive_item in enumerate(archive_items):
+                archive_date = archive_item.get("archive_date")
+                doc_id = document_id(archive_date, row, archive_item)
+                items_by_id.setdefault(doc_id, archive_item)
+                items_by_text.setdefault(index_text(archive_item), archive_item)
+
+        response = []
+        matched_ids = set()
+        for document in matched_documents:
+            doc_id = document.metadata.get("id")
+            archive_item = items_by_id.get(doc_id) or items_by_text.get(
+                document.page_content
+            )
+            if archive_item is not None and id(archive_item) not in matched_ids:
+                matched_ids.add(id(archive_item))
+                response.append(archive_item)
         return response
 
     def get_monthly_archive(self, year, month) -> List[ArchiveItem]:
@@ -109,41 +187,124 @@ class NYTApi:
         if cached_archive := self.cache.get_by_date(year, month):
             logger.info(f"Using cached archive for {year}-{month}")
             return cached_archive
-        archive = self.call_archive_api(year, month)
-        self.cache.put_by_date(year, month, archive)
-        logger.info(f"Creating cached archive for {year}-{month}")
+        key = f"{year}-{month}"
+        with self.cache.lock(key):
+            # another process may have fetched the month while we waited for the lock
+            if cached_archive := self.cache.get_by_date(year, month):
+                logger.info(f"Using {year}-{month} as cached by another process")
+                return cached_archive
+            return self.fetch_monthly_archive(year, month)
+
+    def fetch_monthly_archive(self, year, month) -> List[ArchiveItem]:
+        """Download a month from the API into the cache and return it."""
+        # an expired month is only downloaded again if it changed since we cached it
+        key = f"{year}-{month}"
+        response = self.request_archive(year, month, self.cache.get_validators(key))
+        if response.status_code == 304:
+            response.close()
+            try:
+                archive = self.cache.read(key)
+            except FileNotFoundError:
+                # the cached file went away after we sent its validators
+                logger.warning(f"Cached {year}-{month} is gone, downloading it again")
+                response = self.request_archive(year, month)
+            else:
+                logger.info(
+                    f"Archive for {year}-{month} not modified, refreshing cache"
+                )
+                self.cache.touch(key)
+                return archive
+        for attempt in range(self.body_retries + 1):
+            if attempt:
+                response = self.request_archive(year, month)
+            try:
+                archive = self.download_into_cache(response, year, month)
+            except ArchiveApiError as e:
+                # the cache is written atomically, so a failed download leaves nothing
+                if attempt == self.body_retries:
+                    raise
+                logger.warning(f"{e}, downloading {year}-{month} again")
+            else:
+                logger.info(f"Creating cached archive for {year}-{month}")
+                return archive
+
+    def download_into_cache(self, response, year, month) -> List[ArchiveItem]:
+        # the items are parsed off the socket, so only they (not the raw response)
+        # are held in memory; the columnar cache needs all of them to lay out its
+        # columns, and we return the whole month anyway, so they are written at once
+        archive = list(self.parse_archive_response(response, year, month))
+        self.cache.put_by_date(
+            year, month, archive, validators=get_validators(response)
+        )
         return archive
 
     def call_archive_api(self, year: str, month: str) -> List[ArchiveItem]:
         """This function returns the NYT Archive API response for a given year and month."""
+        return list(self.stream_archive_api(year, month))
+
+    def stream_archive_api(self, year: str, month: str) -> Iterator[ArchiveItem]:
+        """Yield the ArchiveItems of a month as the docs are parsed off the socket, so
+        only one raw doc (not the whole multi-megabyte response) is held in memory.
+        """
+        response = self.request_archive(year, month)
+        yield from self.parse_archive_response(response, year, month)
+
+    def request_archive(self, year: str, month: str, validators=None):
+        """Send the request for a month's archive and return the (streamed) response.
+        With validators from an earlier response, the API answers 304 if the month
+        hasn't changed since."""
         base_url = "https://api.nytimes.com/svc/archive/v1"
         url = f"{base_url}/{int(year)}/{int(month)}.json?api-key={self.api_key}"
+        headers = {}
+        if validators and validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators and validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
         logger.info(f"Calling NYT Archive API for {year}-{month}")
-        response = requests.get(url)
-        status_code = response.status_code
-        if status_code != 200:
+        try:
+            response = self.http_client.get(url, headers=headers, stream=True)
+        except requests.RequestException as e:
+            raise ArchiveApiError(f"Error fetching {year}-{month}: {e}") from e
+        if response.status_code not in (200, 304):
             logger.error(f"API error: {response.text}")
-            raise (Exception(f"Error: {response.text}"))
-        json_response = response.json()
-        return self.map_to_archive_item(json_response, f"{year}-{month}")
+            response.close()
+            raise ArchiveApiError(
+                f"Error fetching {year}-{month} ({response.status_code}): {response.text}"
+            )
+        return response
+
+    def parse_archive_response(self, response, year, month) -> Iterator[ArchiveItem]:
+        """Yield the ArchiveItems of a streamed response. The connection failing (or
+        the body being cut short) part way through raises ArchiveApiError."""
+        with response:
+            response.raw.decode_content = True
+            try:
+                for doc in ijson.items(response.raw, "response.docs.item"):
+                    yield self.map_doc_to_archive_item(doc, f"{year}-{month}")
+            except (
+                ijson.JSONError,
+                urllib3.exceptions.HTTPError,
+                requests.RequestException,
+            ) as e:
+                raise ArchiveApiError(f"Error reading {year}-{month}: {e}") from e
 
     def map_to_archive_item(self, api_response, archive_date) -> List[ArchiveItem]:
         """This function maps each doc in the API response to an ArchiveItem."""
         docs = api_response.get("response", {}).get("docs", [])
         if not docs:
             return []
-        return [
-            ArchiveItem(
-                archive_date=archive_date,
-                pub_date=doc.get("pub_date", ""),
-                headline=doc.get("headline", {}).get("main", ""),
-                abstract=doc.get("abstract", ""),
-                web_url=doc.get("web_url", ""),
-                lead_paragraph=doc.get("lead_paragraph", ""),
-            )
-            for doc in docs
-        ]
+        return [self.map_doc_to_archive_item(doc, archive_date) for doc in docs]
+
+    def map_doc_to_archive_item(self, doc, archive_date) -> ArchiveItem:
+        return ArchiveItem(
+            archive_date=archive_date,
+            pub_date=doc.get("pub_date", ""),
+            headline=doc.get("headline", {}).get("main", ""),
+            abstract=doc.get("abstract", ""),
+            web_url=doc.get("web_url", ""),
+            lead_paragraph=doc.get("lead_paragraph", ""),
+        )
 
     def generate_months(self, start_date: str, end_date: str) -> List[str]:
         """Given the range of months, generate a list of (year, month) tuples
@@ -171,6 +332,15 @@ class NYTApi:
         return dates
 
 
+def get_validators(response):
+    """What the API sent to validate a cached response with, if anything."""
+    validators = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return {name: value for name, value in validators.items() if value} or None
+
+
 def main():
     os.makedirs("logs", exist_ok=True)
     logging.basicConfig(filename="logs/nyt_api.log", level=logging.INFO)
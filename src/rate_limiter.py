@@ -0,0 +1,48 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    RateLimiter is a thread-safe token bucket used to keep calls to a remote API under
+    its per-minute quota. The bucket starts full, so a short burst of up to `burst`
+    calls goes through immediately, after which callers block until a token refills.
+
+    Attributes:
+        requests_per_minute (float): how many calls are allowed per minute on average.
+        burst (int): the maximum number of calls that can be made back to back.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be greater than zero.")
+        self.requests_per_minute = requests_per_minute
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """Block until `amount` tokens are available, then consume them. A call that
+        costs more than the burst only waits for a full bucket."""
+        amount = min(amount, self.burst)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait_seconds = (amount - self._tokens) * 60 / self.requests_per_minute
+            logger.debug(f"Rate limit reached, waiting {wait_seconds:.2f}s")
+            time.sleep(wait_seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(
+            self.burst, self._tokens + elapsed * self.requests_per_minute / 60
+        )
@@ -1,33 +1,34 @@
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 import os
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
 
-def file_is_expired(file_path, key, max_cache_age_days):
+def file_is_expired(file_path, key, max_cache_age_days, file_stat=None):
     """news items get created every day in the archive, so to stay fresh we want to refresh
     the cache periodically, but we don't want to do it all the time -- this max_cache_age_days
     is used to find a balance between freshness and not refreshing too often
+
+    This is for files nothing is known about but their age (their mtime, which a
+    chmod or a copy doesn't change); see is_expired for months in a Manifest.
+    Pass file_stat if the caller already has an os.stat_result for file_path.
     """
-    max_cache_age_milliseconds = max_cache_age_days * 24 * 60 * 60 * 1000
-    is_expired = file_is_for_current_month(key) and file_created_before_max_age(
-        file_path, max_cache_age_milliseconds
-    )
+    if file_stat is None:
+        file_stat = os.stat(file_path)
+    is_expired = is_expired_since(key, file_stat.st_mtime, max_cache_age_days)
     logger.debug(f"file_path: {file_path} is_expired: {is_expired}")
     return is_expired
 
 
-def file_created_before_max_age(file_path, max_cache_age_milliseconds):
-    file_creation_time = os.path.getctime(file_path)
-    current_time = time.time()
-    age_in_milliseconds = (current_time - file_creation_time) * 1000
-    age_in_days = age_in_milliseconds / (24 * 60 * 60 * 1000)
-    logger.debug(
-        f"file_path: {file_path} age in days: {age_in_days} expired: {age_in_milliseconds > max_cache_age_milliseconds}"
-    )
-    return age_in_milliseconds > max_cache_age_milliseconds
+def is_expired_since(key, fetched_at, max_cache_age_days):
+    """Whether the month `key`, fetched at `fetched_at` (seconds since the epoch), is
+    due a refresh. Only the current month changes, so past months never expire."""
+    age_in_days = (time.time() - fetched_at) / (24 * 60 * 60)
+    return file_is_for_current_month(key) and age_in_days > max_cache_age_days
 
 
 def file_is_for_current_month(file_key):
@@ -40,3 +41,19 @@ def get_current_date_key():
     this_year = str(datetime.now().year)
     this_month = f"{datetime.now().month:02d}"
     return f"{this_year}-{this_month}"
+
+
+@contextmanager
+def atomic_write(file_path, mode="w"):
+    """Write file_path through a temporary file that replaces it once the block is
+    done, so readers in any process see either the old file or the new one, never a
+    half written one. If the block fails, file_path is left as it was."""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,127 @@
+import argparse
+from datetime import datetime
+import logging
+import os
+import time
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+from cache import NewsCache
+from index import Index
+from nyt_api import ArchiveApiError, NYTApi
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """
+    CacheWarmer downloads and indexes a rolling window of archive months ahead of time,
+    so interactive searches find them already cached and indexed. Past months never
+    change, so after the first round only the current month is refreshed, whenever
+    its cache or index has expired.
+
+    It takes the same locks as NYTApi and Index, so it can run next to interactive
+    sessions sharing the same cache and index directories.
+
+    Attributes:
+        nyt_api (NYTApi): fetches months into its cache and index.
+        window_months (int): how many months to keep warm, counting back from (and
+            including) the current month.
+        refresh_interval_seconds (float): how long to sleep between rounds.
+    """
+
+    def __init__(self, nyt_api, window_months=24, refresh_interval_seconds=None):
+        self.nyt_api = nyt_api
+        self.window_months = window_months
+        # by default look again as often as the current month can expire
+        self.refresh_interval_seconds = refresh_interval_seconds or (
+            min(nyt_api.cache.max_cache_age_days, nyt_api.index.max_index_age_days)
+            * 24
+            * 60
+            * 60
+        )
+
+    def months(self, today=None) -> List[Tuple[str, str]]:
+        """The (year, month) pairs in the window, most recent first."""
+        today = today or datetime.today()
+        months = []
+        year, month = today.year, today.month
+        for _ in range(self.window_months):
+            months.append((str(year), f"{month:02d}"))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return months
+
+    def warm(self, today=None):
+        """Fetch and index every month in the window that isn't warm yet. A month that
+        fails is logged and left for the next round."""
+        warmed = 0
+        for year, month in self.months(today):
+            try:
+                self.nyt_api.get_and_index_month(year, month)
+                warmed += 1
+            except ArchiveApiError as e:
+                logger.warning(f"Could not warm {year}-{month}: {e}")
+            except Exception:
+                # e.g. the embedding API or the disk failing; the warmer runs unattended,
+                # so one bad month must not stop it
+                logger.exception(f"Could not warm {year}-{month}")
+        logger.info(f"Warmed {warmed} of {self.window_months} months")
+        return warmed
+
+    def run(self, rounds=None):
+        """Warm the window every refresh_interval_seconds, forever or for `rounds`."""
+        completed = 0
+        while rounds is None or completed < rounds:
+            if completed > 0:
+                time.sleep(self.refresh_interval_seconds)
+            self.warm()
+            completed += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep the NYT archive cache and index warm"
+    )
+    parser.add_argument(
+        "--months", type=int, default=24, help="how many months to keep warm"
+    )
+    parser.add_argument(
+        "--interval-hours",
+        type=float,
+        help="hours between refreshes (default: the cache's max age)",
+    )
+    parser.add_argument(
+        "--max-age-days",
+        type=float,
+        default=1,
+        help="when the current month's cache and index expire",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="warm the window once and exit"
+    )
+    args = parser.parse_args()
+
+    os.makedirs("logs", exist_ok=True)
+    logging.basicConfig(
+        filename="logs/warmer.log",
+        level=logging.INFO,
+        format="%(asctime)s.%(levelname)s.%(name)s:%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    nyt_api = NYTApi(
+        os.getenv("NYT_API_KEY"),
+        cache=NewsCache(max_cache_age_days=args.max_age_days),
+        index=Index(max_index_age_days=args.max_age_days),
+    )
+    warmer = CacheWarmer(
+        nyt_api,
+        window_months=args.months,
+        refresh_interval_seconds=args.interval_hours and args.interval_hours * 3600,
+    )
+    warmer.run(rounds=1 if args.once else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from locks import file_lock
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class WebSearchCache:
+    """
+    WebSearchCache keeps web search responses on disk for ttl_seconds, so asking the
+    same thing again (in this session, another process or a later eval run) doesn't
+    spend a request from the search API's quota. Queries are normalized before they
+    are looked up, so "COVID  News" and "news covid" share an entry; the search
+    parameters (e.g. max_results) are part of the key.
+
+    Each response is its own JSON file, written atomically, so processes can share
+    the directory like they share NewsCache's. When there are more than max_entries
+    files the oldest are removed.
+
+    Attributes:
+        cache_path (str): the directory responses are stored in.
+        ttl_seconds (float): how long a response is used before searching again.
+        max_entries (int): the most responses kept on disk.
+        hits (int): searches answered from the cache by this object.
+        misses (int): searches that had to call the search API.
+    """
+
+    def __init__(
+        self, cache_path="cache/web", ttl_seconds=24 * 60 * 60, max_entries=1000
+    ):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    def get(self, query, **params):
+        """The cached response for query and params, or None if there is none or it
+        has expired."""
+        file_path = self.get_path(query, params)
+        try:
+            with open(file_path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+        if entry is not None and time.time() - entry["fetched_at"] > self.ttl_seconds:
+            entry = None
+        self._count(entry is not None)
+        return entry and entry["response"]
+
+    def put(self, query, response, **params):
+        entry = {
+            "query": query,
+            "params": params,
+            "fetched_at": time.time(),
+            "response": response,
+        }
+        with atomic_write(self.get_path(query, params)) as f:
+            json.dump(entry, f)
+        self.evict()
+
+    def get_or_search(self, query, search, **params):
+        """The cached response for query, or search(query, **params)'s, cached."""
+        response = self.get(query, **params)
+        if response is None:
+            response = search(query, **params)
+            self.put(query, response, **params)
+        return response
+
+    def evict(self):
+        """Remove the oldest responses until at most max_entries are left."""
+        with file_lock(os.path.join(self.cache_path, "evict.lock")):
+            entries = []
+            for name in os.listdir(self.cache_path):
+                if not name.endswith(".json"):
+                    continue
+                file_path = os.path.join(self.cache_path, name)
+                try:
+                    entries.append((os.stat(file_path).st_mtime, file_path))
+                except FileNotFoundError:
+                    continue
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort()
+            for _, file_path in entries[: len(entries) - self.max_entries]:
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+
+    def get_path(self, query, params):
+        key = json.dumps(
+            {"query": normalize_query(query), "params": params}, sort_keys=True
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_path, f"{digest}.json")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        logger.debug(f"Web search cache {'hit' if hit else 'miss'}: {self.stats()}")
+
+
+def normalize_query(query):
+    """Lowercase the query's words and sort them, so queries that differ only in case,
+    spacing or word order are the same search."""
+    return " ".join(sorted(query.lower().split()))
@@ -0,0 +1,54 @@
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+TEXTS = [
+    "Senate passes the Inflation Reduction Act",
+    "Kamala Harris campaigns in Pennsylvania",
+    "Harris and Walz hold a rally in Philadelphia, Pennsylvania",
+    "A recipe for salmon and kimchi",
+]
+
+
+def test_tokenize():
+    assert tokenize("Harris’s rally, in D.C.") == [
+        "harris",
+        "s",
+        "rally",
+        "in",
+        "d",
+        "c",
+    ]
+
+
+def test_search_ranks_exact_terms():
+    lexical_index = BM25Index.build([f"id-{i}" for i in range(4)], TEXTS)
+
+    results = lexical_index.search("Harris Philadelphia", k=5)
+
+    assert [row for row, _ in results] == [2, 1]
+    assert results[0][1] > results[1][1]
+    assert lexical_index.search("unknown words", k=5) == []
+
+
+def test_search_texts_are_indexed_but_texts_are_returned():
+    lexical_index = BM25Index.build(
+        ["a", "b"], ["first headline", "second headline"], ["kimchi", "salmon"]
+    )
+    ((row, _),) = lexical_index.search("salmon", k=1)
+    assert lexical_index.texts[row] == "second headline"
+    assert lexical_index.doc_ids[row] == "b"
+
+
+def test_save_and_load(tmp_path):
+    lexical_index = BM25Index.build([f"id-{i}" for i in range(4)], TEXTS)
+    lexical_index.save(tmp_path / "bm25.npz")
+
+    loaded = BM25Index.load(tmp_path / "bm25.npz")
+
+    assert loaded.search("kimchi", k=2) == lexical_index.search("kimchi", k=2)
+    assert loaded.doc_ids.tolist() == [f"id-{i}" for i in range(4)]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]])
+    assert fused == ["c", "a", "b", "d"]
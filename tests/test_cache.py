@@ -1,6 +1,8 @@
+import os
 from datetime import datetime, timedelta
 from typing import List
 import pytest
+from unittest.mock import MagicMock
 from cache import NewsCache
 
 
@@ -28,3 +30,129 @@ def test_cache_age_is_not_expired_for_previous_month(tmp_path):
     last_month = str(datetime.now().month - 1)
     cache.put_by_date(this_year, last_month, "test")
     assert cache.get_by_date(this_year, last_month) == "test"
+
+
+def test_cache_put_streams_iterators(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    items = [{"headline": "first"}, {"headline": "second"}]
+    cache.put_by_date("2024", "01", iter(items))
+    assert cache.get_by_date("2024", "01") == items
+
+
+def test_cache_put_removes_partial_file_when_stream_fails(tmp_path):
+    def failing_items():
+        yield {"headline": "first"}
+        raise ConnectionError("connection dropped")
+
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    with pytest.raises(ConnectionError):
+        cache.put_by_date("2024", "01", failing_items())
+    assert cache.get_by_date("2024", "01") is None
+
+
+def test_repeated_reads_are_served_from_memory(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.put_by_date("2024", "01", [{"headline": "first"}])
+    cache.backend.read = MagicMock(wraps=cache.backend.read)
+
+    assert cache.get_by_date("2024", "01") == [{"headline": "first"}]
+    assert cache.get_by_date("2024", "01") == [{"headline": "first"}]
+
+    assert cache.backend.read.call_count == 1
+    assert cache.memory.hits == 1
+    assert cache.memory.misses == 1
+
+
+def test_memory_is_invalidated_when_the_file_changes(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.put_by_date("2024", "01", [{"headline": "first"}])
+    cache.get_by_date("2024", "01")
+
+    cache.put_by_date("2024", "01", [{"headline": "first"}, {"headline": "second"}])
+
+    assert cache.get_by_date("2024", "01") == [
+        {"headline": "first"},
+        {"headline": "second"},
+    ]
+    assert cache.memory.hits == 0
+
+
+def test_memory_evicts_least_recently_used_months(tmp_path):
+    cache = NewsCache(max_cache_age_days=1, max_memory_items=2)
+    cache.cache_path = tmp_path
+    for month in ["01", "02"]:
+        cache.put_by_date("2024", month, [{"headline": month}])
+        cache.get_by_date("2024", month)
+    cache.get_by_date("2024", "01")
+
+    cache.put_by_date("2024", "03", [{"headline": "03"}])
+    cache.get_by_date("2024", "03")
+
+    stats = cache.memory.stats()
+    assert stats["entries"] == 2
+    assert stats["items"] == 2
+    cache.get_by_date("2024", "02")
+    assert cache.memory.misses == 4
+
+
+def test_failed_write_leaves_the_cached_month_as_it_was(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.put_by_date("2024", "01", [{"headline": "first"}])
+
+    def failing_items():
+        yield {"headline": "second"}
+        raise ConnectionError("connection reset")
+
+    with pytest.raises(ConnectionError):
+        cache.put_by_date("2024", "01", failing_items())
+    assert cache.get_by_date("2024", "01") == [{"headline": "first"}]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_manifest_records_each_cached_month(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.put_by_date(
+        "2024", "01", iter([{"headline": "first"}]), validators={"etag": '"abc"'}
+    )
+
+    entry = cache.manifest.get("2024-01")
+    assert entry["count"] == 1
+    assert entry["etag"] == '"abc"'
+    assert cache.get_validators("2024-01") == {"etag": '"abc"', "last_modified": None}
+    first_hash = cache.get_content_hash("2024-01")
+
+    cache.put_by_date("2024", "01", [{"headline": "second"}])
+    assert cache.get_content_hash("2024-01") != first_hash
+    assert cache.get_validators("2024-01") is None
+
+
+def test_freshness_comes_from_the_fetch_time_not_the_file(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    this_year = str(datetime.now().year)
+    this_month = f"{datetime.now().month:02d}"
+    key = f"{this_year}-{this_month}"
+    two_days_ago = (datetime.now() - timedelta(days=2)).timestamp()
+    cache.put(key, [{"headline": "old"}], fetched_at=two_days_ago)
+    # a chmod (or a copy) of the file doesn't make it fresh again
+    os.chmod(cache.get_path(key), 0o644)
+    assert cache.get_by_date(this_year, this_month) is None
+
+    cache.touch(key)
+    assert cache.get_by_date(this_year, this_month) == [{"headline": "old"}]
+
+
+def test_months_cached_before_the_manifest_are_added_to_it(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.backend.write(cache.get_path("2024-01"), [{"headline": "first"}])
+
+    assert cache.get_by_date("2024", "01") == [{"headline": "first"}]
+    assert cache.manifest.get("2024-01")["content_hash"]
+    assert cache.keys() == ["2024-01"]
@@ -0,0 +1,115 @@
+import json
+import os
+import pytest
+from cache import NewsCache
+from cache_backends import ColumnarBackend, JsonBackend
+from utils import get_current_date_key
+
+ITEMS = [
+    {
+        "archive_date": "2024-09",
+        "headline": "first headline",
+        "abstract": "first abstract",
+        "web_url": "https://www.nytimes.com/first.html",
+    },
+    {
+        "archive_date": "2024-09",
+        "headline": "second headline",
+        "web_url": "https://www.nytimes.com/second.html",
+    },
+]
+
+
+@pytest.mark.parametrize("backend", [ColumnarBackend(), JsonBackend()])
+def test_round_trip(tmp_path, backend):
+    file_path = tmp_path / f"2024-09.{backend.extension}"
+    backend.write(file_path, ITEMS)
+    assert backend.read(file_path) == ITEMS
+
+
+@pytest.mark.parametrize("backend", [ColumnarBackend(), JsonBackend()])
+def test_column_projection(tmp_path, backend):
+    file_path = tmp_path / f"2024-09.{backend.extension}"
+    backend.write(file_path, iter(ITEMS))
+    assert backend.read(file_path, fields=["headline", "abstract"]) == [
+        {"headline": "first headline", "abstract": "first abstract"},
+        {"headline": "second headline"},
+    ]
+
+
+def test_columnar_stores_repeated_values_once(tmp_path):
+    items = [
+        {"archive_date": "2024-09", "headline": f"headline {i}", "section": "U.S."}
+        for i in range(1000)
+    ]
+    backend = ColumnarBackend()
+    backend.write(tmp_path / "columnar", items)
+    JsonBackend().write(tmp_path / "json", items)
+    assert (
+        os.path.getsize(tmp_path / "columnar") < os.path.getsize(tmp_path / "json") / 2
+    )
+    assert backend.read(tmp_path / "columnar") == items
+
+
+def test_columnar_dictionary_encodes_low_cardinality_columns(tmp_path):
+    items = [{"section": section} for section in ["U.S.", "World", "U.S.", "U.S."]]
+    backend = ColumnarBackend()
+    backend.write(tmp_path / "columnar", items)
+    assert backend.read(tmp_path / "columnar") == items
+
+
+def test_columnar_stores_values_that_are_not_items(tmp_path):
+    backend = ColumnarBackend()
+    backend.write(tmp_path / "columnar", "test")
+    assert backend.read(tmp_path / "columnar") == "test"
+
+
+def test_json_cache_is_migrated_on_read(tmp_path):
+    with open(tmp_path / "2024-09.json", "w") as f:
+        json.dump(ITEMS, f)
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+
+    assert cache.keys() == ["2024-09"]
+    assert cache.get_by_date("2024", "09") == ITEMS
+    assert not os.path.exists(tmp_path / "2024-09.json")
+    assert os.path.exists(tmp_path / "2024-09.msgpack")
+    assert cache.read("2024-09", fields=["web_url"]) == [
+        {"web_url": item["web_url"]} for item in ITEMS
+    ]
+
+
+def test_migrated_month_keeps_when_it_was_fetched(tmp_path):
+    # only the current month expires
+    key = get_current_date_key()
+    json_path = tmp_path / f"{key}.json"
+    with open(json_path, "w") as f:
+        json.dump(ITEMS, f)
+    fetched_at = os.stat(json_path).st_mtime - 3 * 24 * 60 * 60
+    os.utime(json_path, (fetched_at, fetched_at))
+    cache = NewsCache(max_cache_age_days=2)
+    cache.cache_path = tmp_path
+
+    assert cache.read(key) == ITEMS
+
+    assert cache.manifest.get(key)["fetched_at"] == fetched_at
+    assert os.stat(tmp_path / f"{key}.msgpack").st_mtime == fetched_at
+    assert cache.get(key, cache.max_cache_age_days) is None
+
+
+def test_expired_json_cache_is_removed_once_refetched(tmp_path):
+    key = get_current_date_key()
+    json_path = tmp_path / f"{key}.json"
+    with open(json_path, "w") as f:
+        json.dump(ITEMS, f)
+    fetched_at = os.stat(json_path).st_mtime - 3 * 24 * 60 * 60
+    os.utime(json_path, (fetched_at, fetched_at))
+    cache = NewsCache(max_cache_age_days=2)
+    cache.cache_path = tmp_path
+    assert cache.get(key, cache.max_cache_age_days) is None
+
+    cache.put(key, ITEMS[:1])
+
+    assert not os.path.exists(json_path)
+    assert cache.keys() == [key]
+    assert cache.get(key, cache.max_cache_age_days) == ITEMS[:1]
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+import numpy as np
+import pytest
+from embedding_cache import CachedEmbeddings
+from test_index import CountingEmbeddings
+
+
+def test_texts_are_embedded_once(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    cached_embeddings = CachedEmbeddings(embeddings, tmp_path)
+
+    first = cached_embeddings.embed_documents(["one", "two", "one"])
+    second = cached_embeddings.embed_documents(["two", "three"])
+
+    assert embeddings.embedded == ["one", "two", "three"]
+    assert first[0] == first[2]
+    assert first[0] == pytest.approx(embeddings.embed_query("one"), rel=1e-6)
+    assert second[0] == first[1]
+    assert cached_embeddings.hits == 2
+    assert cached_embeddings.misses == 3
+
+
+def test_cache_is_shared_across_instances(tmp_path):
+    writer = CachedEmbeddings(CountingEmbeddings(size=8), tmp_path)
+    vectors = writer.embed_documents(["one", "two"])
+
+    embeddings = CountingEmbeddings(size=8)
+    reader = CachedEmbeddings(embeddings, tmp_path)
+
+    assert reader.embed_documents(["two", "one"]) == [vectors[1], vectors[0]]
+    assert embeddings.embedded == []
+
+
+def test_models_do_not_share_vectors(tmp_path):
+    CachedEmbeddings(CountingEmbeddings(size=8), tmp_path, "model-a").embed_documents(
+        ["one"]
+    )
+    embeddings = CountingEmbeddings(size=8)
+    CachedEmbeddings(embeddings, tmp_path, "model-b").embed_documents(["one"])
+    assert embeddings.embedded == ["one"]
+
+
+def test_float16_cache(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    cached_embeddings = CachedEmbeddings(embeddings, tmp_path, dtype="float16")
+    vector = cached_embeddings.embed_query("one")
+    assert vector == cached_embeddings.embed_query("one")
+    assert len(vector) == 8
+
+
+def test_rows_without_keys_are_dropped(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    writer = CachedEmbeddings(embeddings, tmp_path)
+    vectors = writer.embed_documents(["one", "two"])
+    # a writer that died after writing its vectors but before writing their keys
+    with open(os.path.join(writer.cache_dir, "vectors.bin"), "ab") as f:
+        f.write(np.ones(8 * 3 + 2, dtype=np.float32).tobytes())
+
+    cached_embeddings = CachedEmbeddings(embeddings, tmp_path)
+    assert cached_embeddings.embed_documents(["one", "two"]) == vectors
+    three = cached_embeddings.embed_documents(["three"])
+
+    reader = CachedEmbeddings(CountingEmbeddings(size=8), tmp_path)
+    assert reader.embed_documents(["one", "two", "three"]) == vectors + three
+    assert three[0] == pytest.approx(embeddings.embed_query("three"), rel=1e-6)
+
+
+def test_model_is_called_without_holding_the_lock(tmp_path):
+    barrier = threading.Barrier(2, timeout=5)
+
+    class WaitingEmbeddings(CountingEmbeddings):
+        def embed_documents(self, texts):
+            # both threads must be embedding at once to get past the barrier
+            barrier.wait()
+            return super().embed_documents(texts)
+
+    cached_embeddings = CachedEmbeddings(WaitingEmbeddings(size=8), tmp_path)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(
+            executor.map(cached_embeddings.embed_documents, [["one"], ["two"]])
+        )
+
+    assert cached_embeddings.embed_documents(["one", "two"]) == [
+        results[0][0],
+        results[1][0],
+    ]
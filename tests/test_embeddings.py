@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from embeddings import LocalEmbeddings, get_embeddings
+
+
+class FakeSentenceTransformer:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size, **kwargs):
+        self.calls.append(list(texts))
+        return np.array([[float(len(text)), 1.0] for text in texts])
+
+
+def test_local_embeddings_are_encoded_in_batches():
+    embeddings = LocalEmbeddings(batch_size=2)
+    embeddings._model = FakeSentenceTransformer()
+
+    vectors = embeddings.embed_documents(["a", "bb", "ccc"])
+
+    assert vectors == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    assert embeddings.embed_query("dddd") == [4.0, 1.0]
+    assert embeddings._model.calls == [["a", "bb"], ["ccc"], ["dddd"]]
+
+
+def test_local_provider(monkeypatch):
+    monkeypatch.setenv("EMBEDDINGS_PROVIDER", "local")
+    embeddings = get_embeddings(batch_size=16)
+    assert isinstance(embeddings, LocalEmbeddings)
+    assert embeddings.batch_size == 16
+
+
+def test_openai_provider_sends_batch_size_texts_per_request(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    embeddings = get_embeddings("openai", batch_size=2)
+    embeddings.check_embedding_ctx_length = False
+    create = MagicMock(
+        side_effect=lambda input, **kwargs: {
+            "data": [{"embedding": [float(len(text))]} for text in input]
+        }
+    )
+    monkeypatch.setattr(embeddings, "client", MagicMock(create=create))
+
+    vectors = embeddings.embed_documents(["a", "bb", "ccc"])
+
+    assert vectors == [[1.0], [2.0], [3.0]]
+    assert [call.kwargs["input"] for call in create.call_args_list] == [
+        ["a", "bb"],
+        ["ccc"],
+    ]
+
+
+def test_unknown_provider():
+    with pytest.raises(ValueError):
+        get_embeddings("does-not-exist")
@@ -0,0 +1,83 @@
+from formatting import format_archive_response, truncate
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def make_item(n, abstract="An abstract."):
+    return {
+        "archive_date": "2024-09",
+        "pub_date": f"2024-09-{n:02d}T05:00:00+0000",
+        "headline": f"Headline {n}",
+        "abstract": abstract,
+        "lead_paragraph": "A lead paragraph that is left out of the table.",
+        "web_url": f"https://www.nytimes.com/{n}.html",
+    }
+
+
+def test_format_archive_response_table():
+    response = {"status": "Ok", "responses": [make_item(1), make_item(2)]}
+
+    formatted = format_archive_response(response)
+
+    assert formatted.splitlines() == [
+        "Found 2 articles, best matches first.",
+        "| # | date | headline | abstract | url |",
+        "|---|---|---|---|---|",
+        "| 1 | 2024-09-01 | Headline 1 | An abstract. | https://www.nytimes.com/1.html |",
+        "| 2 | 2024-09-02 | Headline 2 | An abstract. | https://www.nytimes.com/2.html |",
+    ]
+
+
+def test_format_archive_response_keeps_best_matches_within_budget():
+    items = [make_item(n) for n in range(1, 31)]
+    response = {"status": "Ok", "responses": items}
+
+    formatted = format_archive_response(
+        response, max_tokens=60, count_tokens=count_words
+    )
+
+    lines = formatted.splitlines()
+    assert count_words(formatted) <= 60
+    assert lines[3].startswith("| 1 | 2024-09-01 | Headline 1 |")
+    kept = len(lines) - 4
+    assert 0 < kept < 30
+    assert lines[-1] == f"({30 - kept} more omitted)"
+
+
+def test_format_archive_response_truncates_and_escapes_cells():
+    item = make_item(1, abstract="a | b\nc " + "word " * 100)
+    response = {"status": "Ok", "responses": [item]}
+
+    formatted = format_archive_response(response, abstract_chars=20)
+
+    assert "| a \\| b c word word… |" in formatted
+
+
+def test_format_archive_response_errors_and_no_results():
+    assert (
+        format_archive_response({"status": "Error", "message": "Too large"})
+        == "Error: Too large"
+    )
+    assert (
+        format_archive_response({"status": "Ok", "responses": []})
+        == "No articles found."
+    )
+
+
+def test_truncate():
+    assert truncate("short", 10) == "short"
+    assert truncate("one two three", 9) == "one two…"
+
+
+def test_format_archive_response_budget_counts_the_newlines():
+    items = [make_item(n) for n in range(1, 31)]
+    response = {"status": "Ok", "responses": items}
+
+    for max_tokens in range(150, 1500, 50):
+        formatted = format_archive_response(
+            response, max_tokens=max_tokens, count_tokens=len
+        )
+
+        assert len(formatted) <= max_tokens
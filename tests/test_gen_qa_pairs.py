@@ -0,0 +1,151 @@
+import json
+from unittest.mock import MagicMock
+
+import httpx
+import openai
+import pytest
+from cache import NewsCache
+from gen_qa_pairs import (
+    GenerationBudget,
+    SeenTexts,
+    gen_qa_pair_file,
+    pending_months,
+    read_generated,
+)
+
+
+def make_cache(tmp_path, count, keys=("2024-09",)):
+    cache = NewsCache()
+    cache.cache_path = str(tmp_path)
+    for key in keys:
+        cache.put(
+            key,
+            [
+                {
+                    "archive_date": key,
+                    "headline": f"Story {n}",
+                    "abstract": "happened",
+                    "web_url": f"https://nyt/{n}",
+                }
+                for n in range(count)
+            ],
+        )
+    return cache
+
+
+def make_model():
+    return MagicMock(
+        side_effect=lambda prompt: json.dumps({"question": "what happened?"})
+    )
+
+
+def generate(cache, output_file, model, budget=None, seen_texts=None):
+    return gen_qa_pair_file(
+        cache,
+        "2024-09",
+        str(output_file),
+        model,
+        budget or GenerationBudget(),
+        seen_texts if seen_texts is not None else SeenTexts(),
+    )
+
+
+def test_partly_written_file_is_resumed(tmp_path):
+    cache = make_cache(tmp_path, 3)
+    output_file = tmp_path / "2024-09_qa_pairs.json"
+    done = {"question": "q", "web_url": "https://nyt/0", "text": "Story 0 happened"}
+    # the run writing Story 1's row crashed half way through it
+    output_file.write_text(json.dumps(done) + "\n" + '{"question": "q", "web_')
+    model = make_model()
+
+    assert generate(cache, output_file, model) == 2
+
+    assert model.call_count == 2
+    rows = read_generated(str(output_file))
+    assert sorted(row["web_url"] for row in rows) == [
+        "https://nyt/0",
+        "https://nyt/1",
+        "https://nyt/2",
+    ]
+    assert len(output_file.read_text().splitlines()) == 4
+
+
+def test_texts_seen_in_other_months_are_skipped(tmp_path):
+    cache = make_cache(tmp_path, 2)
+    model = make_model()
+    seen_texts = SeenTexts({"Story 0 happened"})
+
+    assert generate(cache, tmp_path / "qa.json", model, seen_texts=seen_texts) == 1
+
+    assert seen_texts.texts == {"Story 0 happened", "Story 1 happened"}
+
+
+def test_generation_stops_when_the_budget_is_spent(tmp_path):
+    cache = make_cache(tmp_path, 4)
+    model = make_model()
+    budget = GenerationBudget(max_requests=2)
+    seen_texts = SeenTexts()
+
+    assert generate(cache, tmp_path / "qa.json", model, budget, seen_texts) == 2
+
+    assert model.call_count == 2
+    # the stories left out are free for the next run, or another month
+    assert len(seen_texts.texts) == 2
+    assert seen_texts.claimed == set()
+    assert budget.acquire("prompt") is False
+
+
+def test_api_errors_are_skipped(tmp_path):
+    cache = make_cache(tmp_path, 2)
+    request = httpx.Request("POST", "https://api.openai.com")
+    model = MagicMock(
+        side_effect=[
+            openai.APIConnectionError(request=request),
+            json.dumps({"question": "what happened?"}),
+        ]
+    )
+
+    seen_texts = SeenTexts()
+
+    assert generate(cache, tmp_path / "qa.json", model, seen_texts=seen_texts) == 1
+    # the context that failed can still be generated by another month
+    assert len(seen_texts.texts) == 1
+    assert seen_texts.claimed == set()
+
+
+def test_other_errors_are_raised(tmp_path):
+    cache = make_cache(tmp_path, 1)
+    model = MagicMock(side_effect=TypeError("bug"))
+
+    with pytest.raises(TypeError):
+        generate(cache, tmp_path / "qa.json", model)
+
+
+def test_file_written_by_the_previous_version_is_complete(tmp_path):
+    cache = make_cache(tmp_path, 2)
+    output_file = tmp_path / "2024-09_qa_pairs.json"
+    # llm_generate only wrote what the model answered
+    output_file.write_text(
+        json.dumps({"question": "q", "context": "Story 0 happened"}) + "\n"
+    )
+    model = make_model()
+
+    assert generate(cache, output_file, model) == 0
+
+    model.assert_not_called()
+
+
+def test_only_months_with_stories_left_are_picked(tmp_path):
+    cache = make_cache(tmp_path, 1, keys=["2024-08", "2024-09", "2024-10"])
+    eval_qa_dir = tmp_path / "qa_pairs"
+    eval_qa_dir.mkdir()
+    row = {"question": "q", "web_url": "https://nyt/0", "text": "Story 0 happened"}
+    (eval_qa_dir / "2024-10_qa_pairs.json").write_text(json.dumps(row) + "\n")
+    # a previous run stopped before writing any row
+    (eval_qa_dir / "2024-09_qa_pairs.json").write_text("")
+
+    assert pending_months(cache, str(eval_qa_dir), SeenTexts(), 1) == ["2024-09"]
+    assert pending_months(cache, str(eval_qa_dir), SeenTexts(), 3) == [
+        "2024-09",
+        "2024-08",
+    ]
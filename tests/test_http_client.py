@@ -0,0 +1,66 @@
+from email.utils import formatdate
+import time
+import pytest
+import requests
+import responses
+from http_client import HttpClient, parse_retry_after
+
+URL = "https://api.nytimes.com/svc/archive/v1/2024/9.json"
+
+
+@responses.activate
+def test_rate_limited_requests_are_retried_after_the_retry_after_delay():
+    responses.get(URL, status=429, headers={"Retry-After": "0"})
+    responses.get(URL, status=503)
+    responses.get(URL, json={"ok": True})
+    http_client = HttpClient(backoff_factor=0)
+
+    response = http_client.get(URL)
+
+    assert response.status_code == 200
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_last_response_is_returned_when_retries_run_out():
+    responses.get(URL, status=500)
+    http_client = HttpClient(max_retries=2, backoff_factor=0)
+
+    response = http_client.get(URL)
+
+    assert response.status_code == 500
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_client_errors_are_not_retried():
+    responses.get(URL, status=401)
+    http_client = HttpClient(backoff_factor=0)
+
+    assert http_client.get(URL).status_code == 401
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_connection_errors_are_retried_then_raised():
+    responses.get(URL, body=requests.ConnectionError("connection reset"))
+    http_client = HttpClient(max_retries=1, backoff_factor=0)
+
+    with pytest.raises(requests.ConnectionError):
+        http_client.get(URL)
+    assert len(responses.calls) == 2
+
+
+def test_retry_after_is_seconds_or_a_date():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    in_ten_seconds = formatdate(time.time() + 10, usegmt=True)
+    assert 8 < parse_retry_after(in_ten_seconds) <= 10
+
+
+def test_backoff_doubles_and_is_capped():
+    http_client = HttpClient(backoff_factor=1, max_backoff=5)
+    assert 0.5 <= http_client.get_backoff(0) <= 1
+    assert 2 <= http_client.get_backoff(2) <= 4
+    assert http_client.get_backoff(10) == 5
+    assert http_client.get_backoff(0, retry_after="120") == 5
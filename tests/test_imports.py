@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+SRC_PATH = Path(__file__).parents[1] / "src"
+
+# modules that take a large share of startup, and are only needed once a month is
+# embedded, indexed or searched, or a question is asked
+HEAVY_MODULES = [
+    "openai",
+    "langchain_openai",
+    "langchain_community",
+    "faiss",
+    "tavily",
+    "phoenix",
+    "openinference",
+]
+
+# cumulative import time budgets, in seconds; wall clock time depends on the machine
+# and its load, so they are only checked when CHECK_IMPORT_TIME is set
+IMPORT_BUDGET_SECONDS = {"nyt_api": 1.0, "news_search": 1.0}
+
+
+def import_module(module):
+    """Import module in a fresh interpreter with -X importtime, and return the heavy
+    modules it loaded and its cumulative import time in seconds."""
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": str(SRC_PATH)},
+    )
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    cumulative_us = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.split("|")[-1].strip() == module
+    )
+    return loaded, cumulative_us / 1_000_000
+
+
+def test_importing_nyt_api_defers_heavy_modules():
+    loaded, _ = import_module("nyt_api")
+
+    assert loaded == []
+
+
+def test_importing_news_search_defers_heavy_modules():
+    pytest.importorskip("langgraph")
+    pytest.importorskip("rich")
+
+    loaded, _ = import_module("news_search")
+
+    assert loaded == []
+
+
+@pytest.mark.skipif(
+    not os.getenv("CHECK_IMPORT_TIME"), reason="set CHECK_IMPORT_TIME to check"
+)
+@pytest.mark.parametrize("module", sorted(IMPORT_BUDGET_SECONDS))
+def test_import_time_is_within_budget(module):
+    if module == "news_search":
+        pytest.importorskip("langgraph")
+        pytest.importorskip("rich")
+
+    _, seconds = import_module(module)
+
+    assert seconds < IMPORT_BUDGET_SECONDS[module]
@@ -1,7 +1,11 @@
 from datetime import datetime
 import os
+from typing import List
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from pydantic import Field
+import pytest
 from cache import NewsCache
-from index import Index
+from index import Index, IndexPool
 from nyt_api import ArchiveItem
 
 
@@ -54,6 +58,450 @@ def test_index_recreated_when_index_is_expired(tmp_path):
     assert "Chill in the Housing Market Seeps Into Other Industries bad news" in result
 
 
+def test_expired_index_only_embeds_new_articles(tmp_path):
+    cache = create_cache(
+        tmp_path,
+        [
+            {"headline": "kept", "abstract": "story", "web_url": "https://nyt/kept"},
+            {"headline": "dropped", "abstract": "story", "web_url": "https://nyt/old"},
+        ],
+    )
+    embeddings = CountingEmbeddings(size=16)
+    index = Index(cache=cache, max_index_age_days=0, embeddings=embeddings)
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+    assert embeddings.embedded == ["kept story", "dropped story"]
+
+    create_cache(
+        tmp_path,
+        [
+            {"headline": "kept", "abstract": "story", "web_url": "https://nyt/kept"},
+            {"headline": "added", "abstract": "story", "web_url": "https://nyt/new"},
+        ],
+    )
+    embeddings.embedded.clear()
+    index.create_vector_store(search_date)
+
+    assert embeddings.embedded == ["added story"]
+    vector_store = index.load_vector_store(search_date)
+    indexed = {
+        doc_id: vector_store.docstore.search(doc_id).page_content
+        for doc_id in vector_store.index_to_docstore_id.values()
+    }
+    assert indexed == {
+        "https://nyt/kept": "kept story",
+        "https://nyt/new": "added story",
+    }
+
+
+def test_search_months_ranks_across_months(tmp_path):
+    index = create_index_for_months(tmp_path, unified=False)
+
+    result = index.search_months(["2024-09", "2024-10"], "october story", k=2)
+
+    assert result[0] == "october story"
+    assert len(result) == 2
+
+
+def test_unified_index_restricts_search_to_requested_months(tmp_path):
+    index = create_index_for_months(tmp_path, unified=True)
+
+    assert not os.path.exists(tmp_path / "index" / "2024-09.faiss_index")
+    assert os.path.exists(tmp_path / "index" / "all.faiss_index")
+    result = index.search_months(["2024-09"], "october story")
+    assert result == ["september story"]
+    result = index.search_months(["2024-09", "2024-10"], "october story")
+    assert result == ["october story", "september story"]
+
+
+def test_search_results_carry_the_archive_item_id(tmp_path):
+    cache = create_cache(
+        tmp_path,
+        [
+            {"headline": "with", "abstract": "url", "web_url": "https://nyt/with"},
+            {"headline": "without", "abstract": "url"},
+        ],
+    )
+    index = Index(cache=cache, embeddings=CountingEmbeddings(size=16))
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+
+    documents = index.search_documents_by_vector(
+        [search_date], index.embed_query("without url")
+    )
+
+    assert [document.metadata["id"] for document in documents] == [
+        f"{search_date}#1",
+        "https://nyt/with",
+    ]
+
+
+def test_lexical_matches_are_fused_with_vector_matches(tmp_path):
+    cache = create_cache(
+        tmp_path,
+        [
+            {"headline": "Harris rallies", "abstract": "in Pennsylvania"},
+            {
+                "headline": "Storm",
+                "abstract": "hits Florida",
+                "lead_paragraph": "Harris",
+            },
+            {"headline": "Markets", "abstract": "fall again"},
+        ],
+    )
+    index = Index(
+        cache=cache,
+        embeddings=CountingEmbeddings(size=16),
+        lexical_fields=["headline", "abstract", "lead_paragraph"],
+    )
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+
+    lexical_matches = index.lexical_search([search_date], "Pennsylvania")
+    assert [document.page_content for document in lexical_matches] == [
+        "Harris rallies in Pennsylvania"
+    ]
+    assert lexical_matches[0].metadata == {
+        "id": f"{search_date}#0",
+        "archive_date": search_date,
+    }
+    lexical_matches = index.lexical_search([search_date], "harris")
+    assert len(lexical_matches) == 2
+
+    results = index.search_months([search_date], "Markets fall again", k=3)
+    assert results[0] == "Markets fall again"
+    assert sorted(results) == [
+        "Harris rallies in Pennsylvania",
+        "Markets fall again",
+        "Storm hits Florida",
+    ]
+
+
+def test_only_the_most_recently_used_lexical_indexes_are_kept(tmp_path):
+    index = create_index_for_months(tmp_path, unified=False, max_loaded_months=1)
+
+    lexical_matches = index.lexical_search(["2024-09", "2024-10"], "story")
+
+    assert sorted(document.page_content for document in lexical_matches) == [
+        "october story",
+        "september story",
+    ]
+    assert index._lexical_indexes.stats()["entries"] == 1
+
+
+def test_month_indexed_with_another_embedding_model_is_rebuilt(tmp_path):
+    cache = create_index_for_months(tmp_path, unified=False).cache
+
+    class OtherEmbeddings(CountingEmbeddings):
+        pass
+
+    embeddings = OtherEmbeddings(size=8)
+    index = Index(
+        cache=cache,
+        index_path=str(tmp_path / "index"),
+        embeddings=embeddings,
+    )
+
+    with pytest.raises(ValueError):
+        index.search_months(["2024-09"], "september story")
+    index.create_vector_store("2024-09")
+
+    assert embeddings.embedded == ["september story"]
+    assert index.search_months(["2024-09"], "september story") == ["september story"]
+    assert index.manifest.get("2024-09")["embeddings"] == "OtherEmbeddings"
+
+
+def test_searches_reuse_the_pooled_index_until_it_is_rebuilt(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    pool = IndexPool()
+    index = Index(cache=cache, embeddings=CountingEmbeddings(size=16), pool=pool)
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+
+    assert index.search_index(search_date, "first story") == ["first story"]
+    assert index.search_index(search_date, "first story") == ["first story"]
+    assert (pool.hits, pool.misses) == (2, 0)
+
+    # another process rebuilds the month
+    create_cache(tmp_path, [{"headline": "second", "abstract": "story"}])
+    rebuilder = Index(
+        cache=cache,
+        max_index_age_days=0,
+        embeddings=CountingEmbeddings(size=16),
+        pool=IndexPool(),
+    )
+    rebuilder.index_path = tmp_path
+    rebuilder.create_vector_store(search_date)
+
+    assert index.search_index(search_date, "second story") == ["second story"]
+    assert pool.misses == 1
+
+
+def test_pool_evicts_indexes_over_its_memory_budget(tmp_path):
+    pool = IndexPool(max_bytes=1)
+    index = create_index_for_months(tmp_path, unified=False, pool=pool)
+
+    index.search_months(["2024-09", "2024-10"], "october story")
+
+    assert (pool.hits, pool.misses) == (0, 2)
+
+
+def test_matrix_engine_matches_the_faiss_results(tmp_path):
+    cache = create_cache(
+        tmp_path,
+        [
+            {"headline": f"headline {i}", "abstract": "story", "web_url": f"u{i}"}
+            for i in range(10)
+        ],
+    )
+    search_date = get_search_date()
+    indexes = {}
+    for engine in ["faiss", "matrix"]:
+        indexes[engine] = Index(
+            cache=cache,
+            index_path=str(tmp_path / engine),
+            embeddings=CountingEmbeddings(size=16),
+            hybrid=False,
+            engine=engine,
+        )
+        indexes[engine].create_vector_store(search_date)
+
+    # the matrix is saved in the same version as the FAISS store
+    vector_store_dir = indexes["matrix"].get_vector_store_dir(search_date)
+    assert os.path.exists(os.path.join(vector_store_dir, "vectors.npy"))
+    query_vector = indexes["faiss"].embed_query("headline 3 story")
+    faiss_results = indexes["faiss"].search_documents_by_vector(
+        [search_date], query_vector
+    )
+    matrix_results = indexes["matrix"].search_documents_by_vector(
+        [search_date], query_vector
+    )
+    assert [document.metadata["id"] for document in matrix_results] == [
+        document.metadata["id"] for document in faiss_results
+    ]
+    assert matrix_results[0].page_content == "headline 3 story"
+
+
+def test_matrix_engine_searches_a_unified_index_by_month(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    cache.put_by_date("2024", "09", [{"headline": "september", "abstract": "story"}])
+    cache.put_by_date("2024", "10", [{"headline": "october", "abstract": "story"}])
+    index = Index(
+        cache=cache,
+        index_path=str(tmp_path / "index"),
+        embeddings=CountingEmbeddings(size=16),
+        unified=True,
+        engine="matrix",
+    )
+    index.create_vector_store("2024-09")
+    index.create_vector_store("2024-10")
+
+    assert index.search_months(["2024-09"], "october story") == ["september story"]
+    results = index.matrix_search(
+        ["2024-09", "2024-10"],
+        [index.embed_query("october story"), index.embed_query("september story")],
+        k=1,
+    )
+    assert [[document.page_content for document in r] for r in results] == [
+        ["october story"],
+        ["september story"],
+    ]
+
+
+def test_matrix_saved_before_versioning_is_loaded_until_reindexed(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    index = Index(
+        cache=cache,
+        max_index_age_days=0,
+        index_path=str(tmp_path / "index"),
+        embeddings=CountingEmbeddings(size=16),
+        engine="matrix",
+    )
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+    index_dir = index.get_index_dir(search_date)
+    for name in ["vectors.npy", "vectors.meta.npz"]:
+        os.replace(
+            os.path.join(index.get_vector_store_dir(search_date), name),
+            os.path.join(index_dir, name),
+        )
+
+    assert index.get_matrix_prefix(search_date) == os.path.join(index_dir, "vectors")
+    assert index.search_months([search_date], "first story") == ["first story"]
+
+    create_cache(tmp_path, [{"headline": "second", "abstract": "story"}])
+    index.create_vector_store(search_date)
+
+    assert not os.path.exists(os.path.join(index_dir, "vectors.npy"))
+    assert index.search_months([search_date], "second story") == ["second story"]
+
+
+def test_switching_to_the_matrix_engine_saves_a_new_version(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    search_date = get_search_date()
+    indexes = {
+        engine: Index(
+            cache=cache,
+            index_path=str(tmp_path / "index"),
+            embeddings=CountingEmbeddings(size=16),
+            engine=engine,
+        )
+        for engine in ["faiss", "matrix"]
+    }
+    indexes["faiss"].create_vector_store(search_date)
+    faiss_version = indexes["faiss"].get_vector_store_dir(search_date)
+
+    indexes["matrix"].create_vector_store(search_date)
+
+    # the version readers may have loaded is left as it was
+    assert not os.path.exists(os.path.join(faiss_version, "vectors.npy"))
+    matrix_version = indexes["matrix"].get_vector_store_dir(search_date)
+    assert matrix_version != faiss_version
+    assert os.path.exists(os.path.join(matrix_version, "vectors.npy"))
+    assert indexes["matrix"].search_months([search_date], "first story") == [
+        "first story"
+    ]
+
+
+def test_search_many_embeds_the_queries_in_one_batch(tmp_path):
+    cache = create_cache(
+        tmp_path,
+        [
+            {"headline": f"headline {i}", "abstract": "story", "web_url": f"u{i}"}
+            for i in range(10)
+        ],
+    )
+    search_date = get_search_date()
+    queries = ["headline 2 story", "headline 7 story"]
+    for engine in ["faiss", "matrix"]:
+        embeddings = CountingEmbeddings(size=16)
+        index = Index(
+            cache=cache,
+            index_path=str(tmp_path / engine),
+            embeddings=embeddings,
+            engine=engine,
+        )
+        index.create_vector_store(search_date)
+        embeddings.embedded.clear()
+
+        results = index.search_many(search_date, queries, k=3)
+
+        assert embeddings.embedded == queries
+        assert results == [
+            index.search_months([search_date], query, k=3) for query in queries
+        ]
+        assert [result[0] for result in results] == queries
+
+
+def test_rebuilt_index_is_saved_as_a_new_version(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    index = Index(
+        cache=cache,
+        max_index_age_days=0,
+        embeddings=CountingEmbeddings(size=16),
+        pool=IndexPool(),
+    )
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+    first_version = index.get_vector_store_dir(search_date)
+    reader = index.load_vector_store(search_date)
+
+    create_cache(tmp_path, [{"headline": "second", "abstract": "story"}])
+    index.create_vector_store(search_date)
+    create_cache(
+        tmp_path,
+        [{"headline": "second", "abstract": "story"}, {"headline": "third"}],
+    )
+    index.create_vector_store(search_date)
+
+    # the store a reader already has is never written to, and the version before the
+    # current one is kept for readers that were just about to load it
+    assert reader.docstore.search(reader.index_to_docstore_id[0]).page_content == (
+        "first story"
+    )
+    index_dir = index.get_index_dir(search_date)
+    versions = sorted(name for name in os.listdir(index_dir) if name.startswith("v"))
+    assert len(versions) == 2
+    assert os.path.join(index_dir, versions[-1]) == index.get_vector_store_dir(
+        search_date
+    )
+    assert not os.path.exists(first_version)
+    assert index.search_index(search_date, "second story")[0] == "second story"
+
+
+def test_index_saved_before_versioning_is_still_loaded(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "old", "abstract": "story"}])
+    index = Index(cache=cache, embeddings=CountingEmbeddings(size=16))
+    index.index_path = tmp_path
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+    index_dir = index.get_index_dir(search_date)
+    current = index.get_vector_store_dir(search_date)
+    for name in ["index.faiss", "index.pkl"]:
+        os.replace(os.path.join(current, name), os.path.join(index_dir, name))
+    os.remove(os.path.join(index_dir, "CURRENT"))
+
+    assert index.get_vector_store_dir(search_date) == index_dir
+    assert index.search_index(search_date, "old story") == ["old story"]
+
+
+def test_index_is_rebuilt_only_when_the_cached_content_changes(tmp_path):
+    cache = create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    embeddings = CountingEmbeddings(size=16)
+    index = Index(cache=cache, max_index_age_days=0, embeddings=embeddings)
+    index.index_path = tmp_path / "index"
+    search_date = get_search_date()
+    index.create_vector_store(search_date)
+    version = index.get_vector_store_dir(search_date)
+
+    # refetched, but unchanged
+    create_cache(tmp_path, [{"headline": "first", "abstract": "story"}])
+    index.create_vector_store(search_date)
+    assert index.get_vector_store_dir(search_date) == version
+
+    create_cache(tmp_path, [{"headline": "second", "abstract": "story"}])
+    index.create_vector_store(search_date)
+    assert index.get_vector_store_dir(search_date) != version
+    entry = index.manifest.get(search_date)
+    assert entry["content_hash"] == cache.get_content_hash(search_date)
+    assert entry["count"] == 1
+    assert entry["parts"] == ["bm25", "faiss"]
+
+
+def create_index_for_months(path, unified, pool=None, **kwargs):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = path
+    cache.put_by_date("2024", "09", [{"headline": "september", "abstract": "story"}])
+    cache.put_by_date("2024", "10", [{"headline": "october", "abstract": "story"}])
+    index = Index(
+        cache=cache,
+        index_path=str(path / "index"),
+        embeddings=CountingEmbeddings(size=16),
+        unified=unified,
+        pool=pool,
+        **kwargs,
+    )
+    index.create_vector_store("2024-09")
+    index.create_vector_store("2024-10")
+    return index
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings that remember which documents they were asked to embed."""
+
+    embedded: List[str] = Field(default_factory=list)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
 def get_search_date():
     this_year = str(datetime.now().year)
     this_month = f"{datetime.now().month:02d}"
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import StructuredTool
+
+from llm_cache import LLMCacheMiss, SQLiteLLMCache, record_tool
+
+
+def make_model(cache, *replies):
+    return GenericFakeChatModel(
+        messages=iter([AIMessage(content=reply) for reply in replies]), cache=cache
+    )
+
+
+def test_repeated_calls_are_answered_from_the_cache(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"))
+    model = make_model(cache, "first", "second")
+
+    assert model.invoke("question").content == "first"
+    assert model.invoke("question").content == "first"
+    assert model.invoke("another question").content == "second"
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "entries": 2,
+        "tool_results": 0,
+    }
+
+
+def test_message_ids_are_not_part_of_the_key(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"))
+    model = make_model(cache, "first", "second")
+
+    model.invoke([HumanMessage(content="question", id="1")])
+
+    assert model.invoke([HumanMessage(content="question", id="2")]).content == "first"
+
+
+def test_replay_answers_recorded_calls_and_raises_on_others(tmp_path):
+    database_path = str(tmp_path / "llm.sqlite")
+    make_model(SQLiteLLMCache(database_path, mode="record"), "first").invoke("question")
+    model = make_model(SQLiteLLMCache(database_path, mode="replay"), "unused")
+
+    assert model.invoke("question").content == "first"
+    with pytest.raises(LLMCacheMiss):
+        model.invoke("another question")
+
+
+def test_record_always_calls_the_model(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"), mode="record")
+    model = make_model(cache, "first", "second")
+
+    model.invoke("question")
+
+    assert model.invoke("question").content == "second"
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"), max_entries=2)
+    model = make_model(cache, "one", "two", "three", "four")
+    model.invoke("1")
+    model.invoke("2")
+    model.invoke("1")
+
+    model.invoke("3")
+
+    assert cache.stats()["entries"] == 2
+    assert model.invoke("1").content == "one"
+    assert model.invoke("2").content == "four"
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteLLMCache(str(tmp_path / "llm.sqlite"), mode="sometimes")
+
+
+def test_tool_results_are_recorded_and_replayed(tmp_path):
+    database_path = str(tmp_path / "llm.sqlite")
+    calls = []
+
+    def search(query: str) -> str:
+        """Search for query."""
+        calls.append(query)
+        return f"results for {query}"
+
+    async def asearch(query: str) -> str:
+        """Search for query."""
+        return search(query)
+
+    tool = StructuredTool.from_function(func=search, coroutine=asearch)
+    recorded = record_tool(tool, SQLiteLLMCache(database_path, mode="record"))
+    assert recorded.invoke({"query": "covid"}) == "results for covid"
+    assert asyncio.run(recorded.ainvoke({"query": "flu"})) == "results for flu"
+
+    replayed = record_tool(tool, SQLiteLLMCache(database_path, mode="replay"))
+    assert replayed.invoke({"query": "covid"}) == "results for covid"
+    assert asyncio.run(replayed.ainvoke({"query": "flu"})) == "results for flu"
+    assert calls == ["covid", "flu"]
+    with pytest.raises(LLMCacheMiss):
+        replayed.invoke({"query": "measles"})
+
+
+def test_clear_forgets_responses_and_tool_results(tmp_path):
+    cache = SQLiteLLMCache(str(tmp_path / "llm.sqlite"))
+    make_model(cache, "first").invoke("question")
+    cache.call_tool("search", {"query": "covid"}, lambda: "results")
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["tool_results"] == 1
+
+    cache.clear()
+
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["tool_results"] == 0
+    assert cache.call_tool("search", {"query": "covid"}, lambda: "new") == "new"
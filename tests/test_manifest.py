@@ -0,0 +1,34 @@
+from manifest import Manifest
+
+
+def test_entries_are_merged_and_persisted(tmp_path):
+    manifest = Manifest(tmp_path)
+    manifest.update("2024-09", fetched_at=1.0, etag='"a"')
+    manifest.update("2024-09", fetched_at=2.0)
+
+    assert Manifest(tmp_path).get("2024-09") == {"fetched_at": 2.0, "etag": '"a"'}
+
+
+def test_changes_from_another_process_are_picked_up(tmp_path):
+    reader = Manifest(tmp_path, refresh_seconds=0)
+    writer = Manifest(tmp_path)
+    assert reader.get("2024-09") is None
+
+    writer.update("2024-09", content_hash="abc")
+    writer.update("2024-10", content_hash="def")
+
+    assert reader.get("2024-09") == {"content_hash": "abc"}
+    reader.update("2024-11", content_hash="ghi")
+    assert sorted(
+        Manifest(tmp_path).get(key)["content_hash"]
+        for key in [
+            "2024-09",
+            "2024-10",
+            "2024-11",
+        ]
+    ) == ["abc", "def", "ghi"]
+
+
+def test_one_instance_per_manifest_file(tmp_path):
+    assert Manifest.for_root(tmp_path) is Manifest.for_root(str(tmp_path))
+    assert Manifest.for_root(tmp_path) is not Manifest.for_root(tmp_path, "other.json")
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from matrix_index import MatrixIndex, search_matrices
+
+
+def test_search_ranks_rows_across_matrices_by_l2_distance():
+    rng = np.random.default_rng(0)
+    september = rng.normal(size=(20, 8)).astype(np.float32)
+    october = rng.normal(size=(30, 8)).astype(np.float32)
+    queries = rng.normal(size=(3, 8)).astype(np.float32)
+    matrix_indexes = [
+        MatrixIndex.build(september, [f"s{i}" for i in range(20)], [""] * 20),
+        MatrixIndex.build(october, [f"o{i}" for i in range(30)], [""] * 30),
+    ]
+
+    results = search_matrices(matrix_indexes, queries, k=5)
+
+    everything = np.vstack([september, october])
+    for query, query_results in zip(queries, results):
+        distances = ((everything - query) ** 2).sum(axis=1)
+        expected = np.argsort(distances)[:5]
+        found = [position * 20 + row for position, row in query_results]
+        assert found == expected.tolist()
+
+
+def test_saved_matrix_is_memory_mapped(tmp_path):
+    vectors = np.eye(3, dtype=np.float32)
+    MatrixIndex.build(vectors, ["a", "b", "c"], ["A", "B", "C"]).save(
+        str(tmp_path / "vectors")
+    )
+
+    matrix_index = MatrixIndex.load(str(tmp_path / "vectors"))
+
+    assert isinstance(matrix_index.vectors, np.memmap)
+    assert matrix_index.doc_ids.tolist() == ["a", "b", "c"]
+    assert search_matrices([matrix_index], [0, 1, 0], k=1) == [[(0, 1)]]
+
+
+def test_int8_matrix_keeps_the_ranking(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(50, 16)).astype(np.float32)
+    queries = vectors[:5] + 0.01
+    MatrixIndex.build(vectors, [str(i) for i in range(50)], [""] * 50, "int8").save(
+        str(tmp_path / "vectors")
+    )
+
+    matrix_index = MatrixIndex.load(str(tmp_path / "vectors"))
+
+    assert matrix_index.vectors.dtype == np.int8
+    results = search_matrices([matrix_index], queries, k=1)
+    assert [query_results[0][1] for query_results in results] == [0, 1, 2, 3, 4]
+
+
+def test_unknown_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        MatrixIndex.build(np.zeros((1, 2)), ["a"], ["A"], dtype="float64")
+
+
+def test_int8_matrix_is_scored_a_block_of_rows_at_a_time(monkeypatch):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(10, 8)).astype(np.float32)
+    queries = rng.normal(size=(2, 8)).astype(np.float32)
+    matrix_index = MatrixIndex.build(
+        vectors, [str(i) for i in range(10)], [""] * 10, "int8"
+    )
+    expected = (
+        2 * (queries @ (matrix_index.vectors * matrix_index.scales[:, None]).T)
+        - matrix_index.norms
+    )
+    monkeypatch.setattr(MatrixIndex, "block_rows", 3)
+
+    assert np.allclose(matrix_index.scores(queries), expected, atol=1e-4)
@@ -0,0 +1,97 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+pytest.importorskip("langgraph")
+pytest.importorskip("rich")
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+
+import news_search
+from web_cache import WebSearchCache
+
+
+def tool_call(call_id, name, args):
+    return {"id": call_id, "name": name, "args": args}
+
+
+def make_model():
+    """A model asking for an archive and a web search at once, then answering."""
+    tool_calls = [
+        tool_call(
+            "call_1",
+            "nyt_archive_search",
+            {"topic": "covid", "start_date": "2024-09", "end_date": "2024-10"},
+        ),
+        tool_call("call_2", "web_search", {"query": "covid news"}),
+    ]
+    return GenericFakeChatModel(
+        messages=iter(
+            [
+                AIMessage(
+                    content="",
+                    tool_calls=tool_calls,
+                    additional_kwargs={"tool_calls": tool_calls},
+                    response_metadata={"token_usage": {"completion_tokens": 40}},
+                ),
+                AIMessage(
+                    content="Here is the news about covid.",
+                    response_metadata={"token_usage": {"completion_tokens": 150}},
+                ),
+            ]
+        )
+    )
+
+
+def test_arun_graph_runs_parallel_tool_calls(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    nyt_api = MagicMock()
+    nyt_api.get_archives.return_value = {"status": "Ok", "responses": []}
+    tavily_client = MagicMock(search=AsyncMock(return_value={"results": ["web"]}))
+    monkeypatch.setattr(news_search, "get_nyt_api", lambda: nyt_api)
+    monkeypatch.setattr(news_search, "get_async_tavily_client", lambda: tavily_client)
+    monkeypatch.setattr(
+        news_search,
+        "get_web_search_cache",
+        lambda: WebSearchCache(cache_path=str(tmp_path)),
+    )
+    agent = news_search.NewsSearch()
+    agent.model = make_model()
+    config = {"configurable": {"thread_id": 1}}
+
+    answer = asyncio.run(agent.arun_graph("What happened with covid?", config))
+
+    assert answer == "Here is the news about covid."
+    nyt_api.get_archives.assert_called_once_with("covid", "2024-09", "2024-10")
+    tavily_client.search.assert_awaited_once_with("covid news")
+    messages = agent.graph.get_state(config).values["messages"]
+    tool_messages = {
+        message.name: message.content
+        for message in messages
+        if isinstance(message, ToolMessage)
+    }
+    assert tool_messages == {
+        "nyt_archive_search": "No articles found.",
+        "web_search": "{'results': ['web']}",
+    }
+
+
+def test_clients_are_created_once_across_threads():
+    created = []
+
+    @news_search.create_once
+    def get_client():
+        created.append(object())
+        # long enough for every thread to ask before the first one is done
+        time.sleep(0.05)
+        return created[-1]
+
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(executor.map(lambda _: get_client(), range(8)))
+
+    assert len(created) == 1
+    assert all(client is created[0] for client in clients)
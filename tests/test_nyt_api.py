@@ -1,19 +1,28 @@
+import os
 from nyt_api import NYTApi
 from cache import NewsCache
 from index import Index
 import responses
 import requests
 from unittest.mock import MagicMock
+from langchain_core.documents import Document
 
 
-def make_nytimes(fake_index_responses, max_range=12):
+def make_nytimes(fake_index_responses, max_range=12, max_workers=4):
+    """fake_index_responses are the ids (web_url) of the items the index matches"""
     fake_index = Index()
-    fake_index.search_index = MagicMock(return_value=fake_index_responses)
+    fake_index.embed_query = MagicMock(return_value=[0.1, 0.2])
+    fake_index.search_documents = MagicMock(
+        return_value=[
+            Document(page_content="", metadata={"id": doc_id})
+            for doc_id in fake_index_responses
+        ]
+    )
     fake_index.create_vector_store = MagicMock(return_value=None)
     fake_cache = NewsCache()
     fake_cache.get_by_date = MagicMock(return_value=None)
     fake_cache.put_by_date = MagicMock(return_value=None)
-    return NYTApi("1234567890", max_range, fake_cache, fake_index)
+    return NYTApi("1234567890", max_range, fake_cache, fake_index, max_workers)
 
 
 @responses.activate
@@ -75,7 +84,7 @@ Donald Trump would win the \u201Cnormal gay guy vote.\u201D"
 def test_filter_with_topic_search():
     responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-11.yaml")
     nyt_api = make_nytimes(
-        ["\u2018This Was One of the Most Delicious Recipes We Have Made\u2019"],
+        ["https://www.nytimes.com/2024/11/30/dining/kimchi-recipes.html"],
     )
     ny_times_response = nyt_api.get_archives("Sarah DiGregorio", "2024-11", "2024-11")
     assert ny_times_response["status"] == "Ok"
@@ -90,6 +99,38 @@ five-ingredient dinner to kick-start your taste buds."
     )
 
 
+@responses.activate
+def test_filter_returns_each_match_once_in_rank_order():
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-11.yaml")
+    nyt_api = make_nytimes(
+        [
+            "https://www.nytimes.com/2024/10/31/us/eagle-killer-sentenced-four-years.html",
+            "https://www.nytimes.com/2024/10/31/us/politics/jd-vance-joe-rogan.html",
+            "https://www.nytimes.com/2024/10/31/us/eagle-killer-sentenced-four-years.html",
+        ],
+    )
+    ny_times_response = nyt_api.get_archives("eagles", "2024-11", "2024-11")
+
+    headlines = [item["headline"] for item in ny_times_response["responses"]]
+    assert headlines == [
+        "Man Who Killed Hundreds of Eagles and Hawks Gets Nearly 4 Years in Prison",
+        "Vance Tells Rogan: Teens Become Trans to Get Into Ivy League",
+    ]
+
+
+def test_filter_matches_indexes_without_ids_on_exact_text():
+    nyt_api = make_nytimes([])
+    archive_items = [
+        {"archive_date": "2024-11", "headline": "", "abstract": "", "web_url": "a"},
+        {"archive_date": "2024-11", "headline": "Eagles", "abstract": "", "web_url": "b"},
+    ]
+    nyt_api.index.search_documents.return_value = [
+        Document(page_content="Eagles ")
+    ]
+
+    assert nyt_api.filter_by_topic([archive_items], "eagles") == [archive_items[1]]
+
+
 @responses.activate
 def test_filter_too_strinct_no_matches():
     responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-11.yaml")
@@ -115,6 +156,36 @@ def test_with_multiple_months():
     assert len(archive_items) == 10
 
 
+@responses.activate
+def test_multiple_months_are_indexed_and_returned_in_month_order():
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-10.yaml")
+    nyt_api = make_nytimes([], max_workers=2)
+
+    ny_times_response = nyt_api.get_archives(None, "2024-09", "2024-10")
+
+    archive_dates = [item["archive_date"] for item in ny_times_response["responses"]]
+    assert archive_dates == ["2024-09"] * 5 + ["2024-10"] * 5
+    indexed_dates = sorted(
+        call.args[0] for call in nyt_api.index.create_vector_store.call_args_list
+    )
+    assert indexed_dates == ["2024-09", "2024-10"]
+
+
+@responses.activate
+def test_topic_is_embedded_once_for_all_months():
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-10.yaml")
+    nyt_api = make_nytimes([])
+
+    nyt_api.get_archives("elections", "2024-09", "2024-10")
+
+    nyt_api.index.embed_query.assert_called_once_with("elections")
+    nyt_api.index.search_documents.assert_called_once_with(
+        ["2024-09", "2024-10"], "elections", [0.1, 0.2]
+    )
+
+
 @responses.activate
 def test_with_multiple_months_fail_max_range():
     responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
@@ -131,3 +202,147 @@ def test_with_multiple_months_fail_max_range():
 
     archive_items = ny_times_response["responses"]
     assert len(archive_items) == 0
+
+
+@responses.activate
+def test_monthly_archive_is_downloaded_into_the_cache(tmp_path):
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+    fake_index = Index()
+    fake_index.create_vector_store = MagicMock(return_value=None)
+    nyt_api = NYTApi("1234567890", cache=cache, index=fake_index)
+
+    archive = nyt_api.get_monthly_archive("2024", "09")
+
+    assert len(archive) == 5
+    assert (
+        archive[0]["headline"]
+        == "Help! I\u2019m \u2018Older\u2019 and on the Job Hunt."
+    )
+    assert cache.get_by_date("2024", "09") == archive
+
+
+@responses.activate
+def test_stream_archive_api_yields_archive_items():
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-11.yaml")
+    nyt_api = make_nytimes([])
+
+    archive_items = nyt_api.stream_archive_api("2024", "11")
+
+    first_item = next(archive_items)
+    assert first_item["archive_date"] == "2024-11"
+    assert first_item["headline"] == (
+        "Vance Tells Rogan: Teens Become Trans to Get Into Ivy League"
+    )
+    assert len(list(archive_items)) == 4
+
+
+@responses.activate
+def test_unchanged_month_is_revalidated_instead_of_downloaded(tmp_path):
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+    nyt_api = NYTApi("1234567890", cache=cache, index=Index())
+    archive = nyt_api.get_monthly_archive("2024", "09")
+    etag = '"c0d5f6930f6b2c3aeb4bc8414bd1faca"'
+    assert cache.get_validators("2024-09")["etag"] == etag
+
+    # the month has expired; the API says it hasn't changed
+    responses.reset()
+    responses.get(
+        "https://api.nytimes.com/svc/archive/v1/2024/9.json?api-key=1234567890",
+        status=304,
+        match=[
+            responses.matchers.header_matcher({"If-None-Match": etag})
+        ],
+    )
+    cache.get_by_date = MagicMock(return_value=None)
+    cache.touch = MagicMock(wraps=cache.touch)
+
+    assert nyt_api.get_monthly_archive("2024", "09") == archive
+    cache.touch.assert_called_once_with("2024-09")
+
+
+@responses.activate
+def test_api_errors_are_returned_as_an_error_status():
+    responses.get(
+        "https://api.nytimes.com/svc/archive/v1/2024/9.json?api-key=1234567890",
+        status=401,
+        body="Invalid ApiKey",
+    )
+    nyt_api = make_nytimes([])
+
+    response = nyt_api.get_archives("elections", "2024-09", "2024-09")
+
+    assert response["status"] == "Error"
+    assert "Invalid ApiKey" in response["message"]
+    assert response["responses"] == []
+
+
+@responses.activate
+def test_month_whose_cached_file_is_gone_is_downloaded_again(tmp_path):
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+    nyt_api = NYTApi("1234567890", cache=cache, index=Index())
+    archive = nyt_api.get_monthly_archive("2024", "09")
+    os.remove(cache.get_path("2024-09"))
+
+    assert cache.get_validators("2024-09") is None
+    assert nyt_api.fetch_monthly_archive("2024", "09") == archive
+    assert "If-None-Match" not in responses.calls[-1].request.headers
+    assert cache.get_by_date("2024", "09") == archive
+
+
+@responses.activate
+def test_not_modified_month_without_a_cached_file_is_downloaded_again(tmp_path):
+    responses.get(
+        "https://api.nytimes.com/svc/archive/v1/2024/9.json?api-key=1234567890",
+        status=304,
+        match=[responses.matchers.header_matcher({"If-None-Match": '"gone"'})],
+    )
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+    # the file is removed between sending the validators and reading it
+    cache.get_validators = MagicMock(return_value={"etag": '"gone"'})
+    nyt_api = NYTApi("1234567890", cache=cache, index=Index())
+
+    archive = nyt_api.fetch_monthly_archive("2024", "09")
+
+    assert len(archive) == 5
+    assert [call.response.status_code for call in responses.calls] == [304, 200]
+
+
+@responses.activate
+def test_download_cut_short_is_retried(tmp_path):
+    responses.get(
+        "https://api.nytimes.com/svc/archive/v1/2024/9.json?api-key=1234567890",
+        body='{"response": {"docs": [{"headline": {"main": "cut',
+    )
+    responses._add_from_file(file_path="tests/data/nyt_api_responses_2024-9.yaml")
+    cache = NewsCache()
+    cache.cache_path = tmp_path
+    nyt_api = NYTApi("1234567890", cache=cache, index=Index())
+
+    archive = nyt_api.get_monthly_archive("2024", "09")
+
+    assert len(archive) == 5
+    assert len(responses.calls) == 2
+    assert cache.get_by_date("2024", "09") == archive
+
+
+@responses.activate
+def test_download_that_keeps_breaking_off_is_an_error_status(tmp_path):
+    responses.get(
+        "https://api.nytimes.com/svc/archive/v1/2024/9.json?api-key=1234567890",
+        body='{"response": {"docs": [{"headline": {"main": "cut',
+    )
+    nyt_api = make_nytimes([])
+
+    response = nyt_api.get_archives("elections", "2024-09", "2024-09")
+
+    assert response["status"] == "Error"
+    assert "2024-09" in response["message"]
+    assert len(responses.calls) == nyt_api.body_retries + 1
@@ -0,0 +1,34 @@
+import time
+import pytest
+from rate_limiter import RateLimiter
+
+
+def test_burst_is_not_throttled():
+    rate_limiter = RateLimiter(requests_per_minute=60, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        rate_limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_calls_past_the_burst_wait_for_a_token():
+    # 6000 per minute refills a token every 10 milliseconds
+    rate_limiter = RateLimiter(requests_per_minute=6000, burst=1)
+    rate_limiter.acquire()
+    start = time.monotonic()
+    rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.005
+
+
+def test_requests_per_minute_must_be_positive():
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=0)
+
+
+def test_acquire_can_consume_several_tokens():
+    rate_limiter = RateLimiter(requests_per_minute=6000, burst=10)
+    rate_limiter.acquire(10)
+    start = time.monotonic()
+    rate_limiter.acquire(2)
+    # two tokens refill in 20 milliseconds
+    assert time.monotonic() - start >= 0.015
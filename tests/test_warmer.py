@@ -0,0 +1,75 @@
+from datetime import datetime
+import threading
+import time
+from unittest.mock import MagicMock
+from cache import NewsCache
+from index import Index
+from locks import file_lock
+from nyt_api import ArchiveApiError, NYTApi
+from warmer import CacheWarmer
+
+
+def make_warmer(tmp_path, window_months):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    index = Index(index_path=str(tmp_path / "index"))
+    nyt_api = NYTApi("1234567890", cache=cache, index=index)
+    nyt_api.get_and_index_month = MagicMock(return_value=[])
+    return CacheWarmer(nyt_api, window_months=window_months)
+
+
+def test_window_counts_back_across_the_year(tmp_path):
+    warmer = make_warmer(tmp_path, window_months=3)
+
+    assert warmer.months(datetime(2025, 2, 14)) == [
+        ("2025", "02"),
+        ("2025", "01"),
+        ("2024", "12"),
+    ]
+
+
+def test_failed_months_are_skipped(tmp_path):
+    warmer = make_warmer(tmp_path, window_months=3)
+    warmer.nyt_api.get_and_index_month.side_effect = [
+        [],
+        ArchiveApiError("429"),
+        [],
+    ]
+
+    assert warmer.warm(datetime(2025, 2, 14)) == 2
+    assert warmer.nyt_api.get_and_index_month.call_count == 3
+
+
+def test_months_failing_to_index_are_skipped(tmp_path):
+    warmer = make_warmer(tmp_path, window_months=2)
+    warmer.nyt_api.get_and_index_month.side_effect = [OSError("disk full"), []]
+
+    assert warmer.warm(datetime(2025, 2, 14)) == 1
+    assert warmer.nyt_api.get_and_index_month.call_count == 2
+
+
+def test_refresh_interval_defaults_to_the_cache_max_age(tmp_path):
+    warmer = make_warmer(tmp_path, window_months=1)
+
+    assert warmer.refresh_interval_seconds == 24 * 60 * 60
+
+
+def test_month_being_fetched_elsewhere_is_waited_for_and_reused(tmp_path):
+    cache = NewsCache(max_cache_age_days=1)
+    cache.cache_path = tmp_path
+    nyt_api = NYTApi("1234567890", cache=cache, index=Index())
+    nyt_api.fetch_monthly_archive = MagicMock(return_value=[])
+
+    with file_lock(f"{tmp_path}/2024-09.lock"):
+        # the warmer holds the lock while it downloads the month
+        fetched = []
+        reader = threading.Thread(
+            target=lambda: fetched.append(nyt_api.get_monthly_archive("2024", "09"))
+        )
+        reader.start()
+        time.sleep(0.05)
+        cache.put_by_date("2024", "09", [{"headline": "warm"}])
+    reader.join()
+
+    assert fetched == [[{"headline": "warm"}]]
+    nyt_api.fetch_monthly_archive.assert_not_called()
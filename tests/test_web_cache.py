@@ -0,0 +1,57 @@
+import os
+import time
+from unittest.mock import MagicMock
+
+from web_cache import WebSearchCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  COVID   News\n") == "covid news"
+    assert normalize_query("news covid") == normalize_query("Covid NEWS")
+
+
+def test_get_or_search_searches_once(tmp_path):
+    cache = WebSearchCache(cache_path=str(tmp_path))
+    search = MagicMock(return_value={"results": ["a"]})
+
+    first = cache.get_or_search("COVID news", search)
+    second = cache.get_or_search("news  covid", search)
+
+    assert first == second == {"results": ["a"]}
+    search.assert_called_once_with("COVID news")
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_responses_are_shared_between_caches(tmp_path):
+    WebSearchCache(cache_path=str(tmp_path)).put("covid", {"results": ["a"]})
+
+    assert WebSearchCache(cache_path=str(tmp_path)).get("covid") == {"results": ["a"]}
+
+
+def test_params_are_part_of_the_key(tmp_path):
+    cache = WebSearchCache(cache_path=str(tmp_path))
+    cache.put("covid", {"results": ["a"]}, max_results=5)
+
+    assert cache.get("covid") is None
+    assert cache.get("covid", max_results=5) == {"results": ["a"]}
+
+
+def test_expired_responses_are_not_returned(tmp_path, monkeypatch):
+    cache = WebSearchCache(cache_path=str(tmp_path), ttl_seconds=60)
+    cache.put("covid", {"results": ["a"]})
+    now = time.time()
+
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+
+    assert cache.get("covid") is None
+
+
+def test_oldest_responses_are_evicted(tmp_path):
+    cache = WebSearchCache(cache_path=str(tmp_path), max_entries=2)
+    for n, query in enumerate(["one", "two", "three"]):
+        cache.put(query, {"results": [query]})
+        os.utime(cache.get_path(query, {}), (n, n))
+
+    assert cache.get("one") is None
+    assert cache.get("two") == {"results": ["two"]}
+    assert cache.get("three") == {"results": ["three"]}